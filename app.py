@@ -1,120 +1,247 @@
 import os
-import tempfile
-import pandas as pd
+import time
+from concurrent.futures import CancelledError
+
 import streamlit as st
-from horas import (
-    process_file, Persist, open_as_xlsx,
-    find_all_proyectos_positions, extract_recurso_line,
-    normalize_project, read_cell
-)
+from horas import (process_file, collect_discovered, Persist, ParseCache, PARSE_CACHE, Informe, JobManager, Cancelado,
+                   EXPORTADORES, formatos_salida, discover_stream, MODOS_MULTIHOJA, parse_libro, describir_conflictos)
 
 st.set_page_config(page_title="Transformador Excel → IPI (web)", layout="wide")
 st.title("Transformador Excel → IPI (web)")
 
-persist = Persist.load()
-
-def discover(path):
-    """Devuelve (recursos, proyectos{codigo:nombre}) sin generar salida."""
-    xlsx, wb = open_as_xlsx(path)
-    ws = wb.active
-    pos = find_all_proyectos_positions(ws)
-    recursos = set()
-    proyectos = {}
-    for i, r in enumerate(pos):
-        recursos.add(extract_recurso_line(ws, r) or "RECURSO DESCONOCIDO")
-        r1 = r
-        r2 = pos[i+1] - 2 if i < len(pos) - 1 else ws.max_row
-        for rr in range(r1, r2 + 1):
-            t = read_cell(ws, rr, 1) or read_cell(ws, rr, 2)
-            p = normalize_project(t or "")
-            if p:
-                proyectos[p[0]] = p[1]
-    return sorted(recursos), dict(sorted(proyectos.items()))
+# Una instancia por sesión; refresh() solo relee si otra sesión ha guardado cambios.
+if "persist" not in st.session_state:
+    st.session_state.persist = Persist.load()
+persist = st.session_state.persist
+persist.refresh()
+if persist.conflictos_importados:
+    st.warning(describir_conflictos(persist.conflictos_importados))
+
+@st.cache_resource
+def job_manager() -> JobManager:
+    """Un único ejecutor por servidor: acota el CPU que consumen las sesiones a la vez."""
+    return JobManager(max_workers=2, max_pending=8)
+
+jobs = job_manager()
+
+@st.cache_resource
+def libro_cache() -> ParseCache:
+    """ParsedLibro compartidos entre sesiones, acotados como PARSE_CACHE."""
+    return ParseCache(max_items=4)
+
+HOJAS_JOBS = 2  # procesos por libro en modo multihoja: varias sesiones comparten el servidor
+
+def parse_libro_job(data: bytes, nombre: str, progreso):
+    return parse_libro(data, nombre, Informe(enabled=False, progreso=progreso), jobs=HOJAS_JOBS)
 
 up = st.file_uploader("Sube el .xls/.xlsx", type=["xls", "xlsx"])
+multihoja = st.selectbox("Hojas", [None] + list(MODOS_MULTIHOJA),
+                         format_func=lambda m: "Solo la hoja activa" if m is None else f"Todas: {MODOS_MULTIHOJA[m]}",
+                         help="Con todas, se procesan las hojas que tengan rejilla de días y 'Proyectos:'.")
+streaming = st.checkbox("Modo de baja memoria (exportaciones muy grandes)", disabled=multihoja is not None,
+                        help="Lee y escribe fila a fila sin cargar la hoja; cada proceso vuelve a leer el fichero.")
+streaming = streaming and multihoja is None
+if streaming and up and up.name.lower().endswith(".xls"):
+    st.info("Con .xls el modo de baja memoria ahorra menos: xlrd carga la hoja entera. "
+            "Para exportaciones muy grandes, mejor .xlsx.")
 
 if up:
-    with tempfile.TemporaryDirectory() as td:
-        in_path = os.path.join(td, up.name)
-        with open(in_path, "wb") as f:
-            f.write(up.read())
-
-        recursos, proyectos = discover(in_path)
-
-        # ---------- Clasificación con casillas (código + nombre) ----------
-        with st.expander("Clasificar proyectos (persistente)", expanded=True):
-            st.write("Marca tipo por fila. Si marcas ambos, se guarda **CONSTRUCCIÓN**.")
-
-            rows = []
-            for cod, nom in proyectos.items():
-                rows.append({
-                    "Código": cod,
-                    "Nombre": nom,
-                    "CONSTRUCCIÓN": persist.tipos.get(cod, "") == "CONSTRUCCION",
-                    "REPARACIÓN": persist.tipos.get(cod, "") == "REPARACION",
-                })
-            df = pd.DataFrame(rows)
-
-            edited = st.data_editor(
-                df,
-                hide_index=True,
-                use_container_width=True,
-                column_config={
-                    "CONSTRUCCIÓN": st.column_config.CheckboxColumn(),
-                    "REPARACIÓN": st.column_config.CheckboxColumn(),
-                },
-                disabled=["Código", "Nombre"],
-                key="df_clasificacion",
-            )
-
-            if st.button("Guardar clasificación"):
-                for _, row in edited.iterrows():
-                    cod = str(row["Código"])
-                    nom = str(row["Nombre"])
-                    con = bool(row["CONSTRUCCIÓN"])
-                    rep = bool(row["REPARACIÓN"])
+    informe_parseo = Informe()
+    data = up.getvalue()
+    if multihoja:
+        # El libro se parsea una vez por contenido y sin exclusiones, en el ejecutor compartido;
+        # el modo solo cambia la salida.
+        clave = PARSE_CACHE.key(data)
+        parsed = libro_cache().get(clave)
+        if parsed is None:
+            pend = st.session_state.get("job_libro")
+            job = jobs.get(pend[1]) if pend and pend[0] == clave else None
+            fallo = st.session_state.get("libro_fallo")
+            if job is None and fallo and fallo[0] == clave:
+                # No se relanza sola: tras cancelar o fallar, solo a petición.
+                st.warning(fallo[1])
+                if st.button("Volver a leer el libro"):
+                    del st.session_state["libro_fallo"]
+                    st.rerun()
+                st.stop()
+            if job is None:
+                try:
+                    st.session_state.job_libro = (clave, jobs.submit(parse_libro_job, data, up.name))
+                except RuntimeError as e:
+                    st.error(str(e)); st.stop()
+                st.rerun()
+            if not job.done():
+                st.progress(job.progreso.fraccion(), text=f"Leyendo hojas: {job.progreso.texto()}")
+                if st.button("Cancelar", disabled=job.progreso.cancelled):
+                    jobs.cancel(pend[1])
+                time.sleep(0.5)
+                st.rerun()
+            jobs.forget(pend[1])
+            del st.session_state["job_libro"]
+            try:
+                libro_cache().put(clave, job.result())
+            except (Cancelado, CancelledError):
+                st.session_state.libro_fallo = (clave, "Lectura cancelada.")
+            except Exception as e:
+                st.session_state.libro_fallo = (clave, f"Error al leer el libro: {e}")
+            st.rerun()
+        recursos, proyectos = parsed.discovered()
+    elif streaming:
+        # Solo se guarda lo descubierto (recursos y proyectos), nunca las filas.
+        clave = PARSE_CACHE.key(data)
+        if st.session_state.get("descubiertos", (None,))[0] != clave:
+            st.session_state.descubiertos = (clave, discover_stream(data, up.name))
+        parsed = None
+        recursos, proyectos = st.session_state.descubiertos[1]
+    else:
+        # Mismo contenido -> mismo ParsedSheet: los reruns no vuelven a parsear el Excel.
+        parsed = PARSE_CACHE.parse_bytes(data, up.name, informe_parseo)
+        recursos, proyectos = parsed.discovered()
+    # Se guarda aquí, en el persist de la sesión: el trabajo de fondo solo ve una instantánea.
+    collect_discovered(recursos, proyectos, persist)
+
+    # ---------- Clasificación paginada (código + nombre) ----------
+    with st.expander("Clasificar proyectos (persistente)", expanded=True):
+        st.write("Marca tipo por fila. Si marcas ambos, se guarda **CONSTRUCCIÓN**. "
+                 "Los cambios de cada página se acumulan hasta pulsar *Guardar*.")
+
+        f1, f2, f3, f4 = st.columns([1, 2, 1, 1])
+        f_cod = f1.text_input("Código", key="f_cod").strip()
+        f_nom = f2.text_input("Nombre contiene", key="f_nom").strip().lower()
+        f_pend = f3.checkbox("Solo sin clasificar", key="f_pend")
+        f_todos = f4.checkbox("Incluir otros ficheros", key="f_todos",
+                              help="También los proyectos guardados de exportaciones anteriores")
+
+        pendientes = st.session_state.setdefault("clasif_pendiente", {})  # código -> tipo sin guardar
+        fuente = dict(persist.nombres, **proyectos) if f_todos else proyectos
+
+        def tipo_actual(cod):
+            return pendientes.get(cod, persist.tipos.get(cod, ""))
+
+        codigos = [cod for cod, nom in fuente.items()
+                   if (not f_cod or cod.startswith(f_cod))
+                   and (not f_nom or f_nom in nom.lower())
+                   and (not f_pend or not tipo_actual(cod))]
+        codigos.sort()
+
+        p1, p2 = st.columns([1, 3])
+        por_pagina = p1.selectbox("Por página", [25, 50, 100, 250], index=1, key="por_pagina")
+        n_paginas = max(1, -(-len(codigos) // por_pagina))
+        pagina = min(p2.number_input("Página", min_value=1, value=1, step=1, key="pagina"), n_paginas)
+        st.caption(f"{len(codigos)} proyectos · página {pagina} de {n_paginas}")
+        visibles = codigos[(pagina - 1) * por_pagina: pagina * por_pagina]
+
+        import pandas as pd  # solo para el editor: no se carga hasta que hay un fichero
+        df = pd.DataFrame({
+            "Código": visibles,
+            "Nombre": [fuente[c] for c in visibles],
+            "CONSTRUCCIÓN": [tipo_actual(c) == "CONSTRUCCION" for c in visibles],
+            "REPARACIÓN": [tipo_actual(c) == "REPARACION" for c in visibles],
+        })
+        # La clave depende del filtro y la página: las ediciones no saltan de una página a otra.
+        vista = f"{f_cod}|{f_nom}|{f_pend}|{f_todos}|{por_pagina}|{pagina}"
+        edited = st.data_editor(
+            df,
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "CONSTRUCCIÓN": st.column_config.CheckboxColumn(),
+                "REPARACIÓN": st.column_config.CheckboxColumn(),
+            },
+            disabled=["Código", "Nombre"],
+            key=f"df_clasificacion|{vista}",
+        )
+
+        for cod, con, rep in zip(edited["Código"], edited["CONSTRUCCIÓN"], edited["REPARACIÓN"]):
+            tipo = "CONSTRUCCION" if con else "REPARACION" if rep else ""
+            if tipo != tipo_actual(cod):
+                pendientes[cod] = tipo
+
+        cambios = {cod: t for cod, t in pendientes.items() if persist.tipos.get(cod, "") != t}
+        if st.button(f"Guardar clasificación ({len(cambios)} cambios)"):
+            for cod, tipo in cambios.items():
+                persist.tipos[cod] = tipo
+                nom = fuente.get(cod)
+                if nom and persist.nombres.get(cod) != nom:
                     persist.nombres[cod] = nom
-                    if con and not rep:
-                        persist.tipos[cod] = "CONSTRUCCION"
-                    elif rep and not con:
-                        persist.tipos[cod] = "REPARACION"
-                    elif con and rep:
-                        persist.tipos[cod] = "CONSTRUCCION"
-                    else:
-                        persist.tipos[cod] = ""
-                persist.asked_clasif = True
-                persist.save()
-                st.success("Clasificación guardada.")
-
-        # ---------- Exclusiones (opcional) ----------
-        with st.expander("Exclusiones persistentes"):
-            col1, col2 = st.columns(2)
-
-            with col1:
-                st.caption("Recursos a excluir")
-                rec_map = {r: st.checkbox(r, value=(r in persist.excluir_recursos)) for r in recursos}
-
-            with col2:
-                st.caption("Proyectos a excluir")
-                proy_map = {
-                    cod: st.checkbox(f"{cod} - {proyectos[cod]}", value=(cod in persist.excluir_proyectos))
-                    for cod in proyectos.keys()
-                }
-
-            if st.button("Guardar exclusiones"):
-                persist.excluir_recursos = [k for k, v in rec_map.items() if v]
-                persist.excluir_proyectos = [k for k, v in proy_map.items() if v]
-                persist.asked_excl = True
-                persist.save()
-                st.success("Exclusiones guardadas.")
-
-        # ---------- Procesar ----------
+            persist.asked_clasif = True
+            persist.save()
+            pendientes.clear()
+            st.success(f"Clasificación guardada ({len(cambios)} cambios).")
+
+    # ---------- Exclusiones (opcional) ----------
+    with st.expander("Exclusiones persistentes"):
+        col1, col2 = st.columns(2)
+        nombres_proy = dict(persist.nombres, **proyectos)
+
+        with col1:
+            opciones_rec = sorted(set(recursos) | set(persist.excluir_recursos))
+            excl_rec = st.multiselect("Recursos a excluir", opciones_rec,
+                                      default=sorted(persist.excluir_recursos), key="excl_rec")
+
+        with col2:
+            opciones_proy = sorted(set(proyectos) | set(persist.excluir_proyectos))
+            excl_proy = st.multiselect("Proyectos a excluir", opciones_proy,
+                                       default=sorted(persist.excluir_proyectos), key="excl_proy",
+                                       format_func=lambda c: f"{c} - {nombres_proy.get(c, '')}")
+
+        if st.button("Guardar exclusiones"):
+            if set(excl_rec) != set(persist.excluir_recursos):
+                persist.excluir_recursos = list(excl_rec)
+            if set(excl_proy) != set(persist.excluir_proyectos):
+                persist.excluir_proyectos = list(excl_proy)
+            persist.asked_excl = True
+            persist.save()
+            st.success("Exclusiones guardadas.")
+
+    # ---------- Procesar ----------
+    # process_file corre en segundo plano; cada rerun consulta el trabajo de la sesión.
+    job_id = st.session_state.get("job_id")
+    job = jobs.get(job_id) if job_id else None
+
+    formato = st.selectbox("Formato de salida", ["xlsx"] if multihoja else formatos_salida(),
+                           help="xlsx = hoja IPI; csv/jsonl/parquet = registros por recurso, proyecto y día")
+    if job is None:
         if st.button("Procesar y generar IPI"):
-            out_path = process_file(in_path, persist)
-            with open(out_path, "rb") as f:
-                st.download_button(
-                    "Descargar _IPI.xlsx",
-                    data=f.read(),
-                    file_name=os.path.basename(out_path),
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+            try:
+                st.session_state.job_id = jobs.submit(
+                    process_file, data, persist.snapshot(), parsed=parsed, filename=up.name, formato=formato,
+                    streaming=streaming, multihoja=multihoja)
+                st.session_state.pop("resultado", None)
+            except RuntimeError as e:
+                st.error(str(e))
+            st.rerun()
+    elif not job.done():
+        st.progress(job.progreso.fraccion(), text=job.progreso.texto())
+        if st.button("Cancelar", disabled=job.progreso.cancelled):
+            jobs.cancel(job_id)
+        time.sleep(0.5)
+        st.rerun()
+    else:
+        jobs.forget(job_id)
+        del st.session_state["job_id"]
+        try:
+            informe = job.result()
+        except (Cancelado, CancelledError):
+            st.warning("Procesado cancelado.")
+        except Exception as e:
+            st.error(f"Error al procesar: {e}")
+        else:
+            st.session_state.resultado = (informe.nombre_salida, informe.buffer.getvalue())
+            st.session_state.informe = informe.merge(informe_parseo).to_dict()
+        st.rerun()
+
+    if "resultado" in st.session_state:
+        nombre, contenido = st.session_state.resultado
+        ext = os.path.splitext(nombre)[1]
+        exp = EXPORTADORES.get(ext[1:])
+        st.download_button(
+            f"Descargar _IPI{ext}",
+            data=contenido,
+            file_name=nombre,
+            mime=exp.mime if exp else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
+
+    if "informe" in st.session_state:
+        with st.expander("Informe de rendimiento", expanded=False):
+            st.json(st.session_state.informe)
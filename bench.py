@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark por etapas del pipeline de horas.py sobre partes sintéticos.
+
+    python bench.py                       # 10/100/1000 recursos, .xlsx
+    python bench.py --sizes 100 5000 --formato xls --repeat 3 --json bench.json
+    python bench.py --arranque                                  # sale con 1 si se supera el presupuesto
+    python bench.py --arranque --import-budget 150              # presupuesto propio
+
+Para cada tamaño se mide el tiempo de cada etapa (open, detect_day_grid,
+find_all_proyectos_positions, parse_block, build_output, save) y el pico de
+memoria de Python (tracemalloc) de todo el recorrido.
+
+Con --arranque solo se mide el arranque, en procesos nuevos: lo que tarda
+"import horas" y "python horas.py --help" completo, contra IMPORT_BUDGET_MS y
+ARRANQUE_BUDGET_MS (o los valores dados). También falla si importar horas carga
+alguno de los motores pesados (MOTORES_PESADOS).
+"""
+
+import os, sys, json, time, tempfile, argparse, subprocess, tracemalloc
+from typing import Dict, List, Optional
+
+import horas
+from generador import generate
+
+STAGES = ["open", "detect_day_grid", "find_all_proyectos_positions", "parse_block", "build_output", "save"]
+
+def run_pipeline(path: str, out_path: str) -> Dict[str, float]:
+    """Recorre el pipeline de process_file etapa a etapa, sin caché ni persistencia."""
+    t: Dict[str, float] = {}
+    persist = horas.Persist(readonly=True)
+
+    t0 = time.perf_counter()
+    ws = horas.open_grid(path)
+    t["open"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    n_days, day_start = horas.detect_day_grid(ws)
+    t["detect_day_grid"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    idx = horas.build_row_index(ws, n_days, day_start)
+    pos = horas.find_all_proyectos_positions(ws, idx)
+    t["find_all_proyectos_positions"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    rows = []
+    for i, r1 in enumerate(pos):
+        r2 = pos[i+1]-2 if i < len(pos)-1 else ws.max_row
+        recurso = horas.extract_recurso_line(ws, r1, n_days, day_start, idx)
+        rows.extend(horas.parse_block(ws, r1, r2, recurso, n_days, day_start, idx))
+    t["parse_block"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    wb_out = horas.libro_salida()
+    horas.build_output(wb_out, horas.TablaHoras.from_rows(rows, n_days), persist, n_days)
+    t["build_output"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    wb_out.save(out_path)
+    t["save"] = time.perf_counter() - t0
+    t["_filas"] = len(rows)
+    return t
+
+def bench(sizes: List[int], formato: str = "xlsx", repeat: int = 1) -> List[Dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as td:
+        for n in sizes:
+            src = os.path.join(td, f"sintetico_{n}.{formato}")
+            generate(src, n)
+            out = os.path.join(td, f"sintetico_{n}_IPI.xlsx")
+            best: Dict[str, float] = {}
+            for _ in range(repeat):  # nos quedamos con el mejor tiempo de cada etapa
+                t = run_pipeline(src, out)
+                for k, v in t.items():
+                    best[k] = min(best.get(k, v), v)
+            tracemalloc.start()
+            run_pipeline(src, out)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append({
+                "recursos": n, "formato": formato, "filas": int(best.pop("_filas")),
+                "etapas": {k: round(best[k], 4) for k in STAGES},
+                "total": round(sum(best[k] for k in STAGES), 4),
+                "pico_mb": round(peak / 2**20, 1),
+            })
+    return results
+
+# Presupuesto de arranque (mejor de N, en ms). Holgado respecto a lo medido (~90-140 / ~200 ms)
+# para absorber máquinas lentas, pero lejos de los ~260 ms que costaba importar openpyxl.
+IMPORT_BUDGET_MS = 200
+ARRANQUE_BUDGET_MS = 400
+
+# Deben cargarse solo en el camino que los usa, nunca al importar horas.
+MOTORES_PESADOS = ["openpyxl", "xlrd", "pandas", "pyarrow", "tkinter", "win32com"]
+
+_MEDIR_IMPORT = (
+    "import sys, time, json; t0 = time.perf_counter(); import horas; "
+    "print(json.dumps([time.perf_counter() - t0, [m for m in %r if m in sys.modules]]))" % MOTORES_PESADOS
+)
+
+def medir_arranque(repeat: int = 5) -> Dict:
+    """Mejor tiempo (ms) de importar horas y de un arranque completo de la CLI, cada uno
+    en un intérprete nuevo, y los motores pesados que haya cargado el import."""
+    cwd = os.path.dirname(os.path.abspath(horas.__file__))
+    imp, arranque, cargados = [], [], []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _MEDIR_IMPORT], cwd=cwd, check=True,
+                             capture_output=True, text=True).stdout
+        t, cargados = json.loads(out)
+        imp.append(t)
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "horas.py", "--help"], cwd=cwd, check=True, capture_output=True)
+        arranque.append(time.perf_counter() - t0)
+    return {"import_ms": round(min(imp) * 1000, 1), "arranque_ms": round(min(arranque) * 1000, 1),
+            "motores_cargados": cargados}
+
+def comprobar_arranque(res: Dict, import_budget: Optional[float] = IMPORT_BUDGET_MS,
+                       arranque_budget: Optional[float] = ARRANQUE_BUDGET_MS) -> List[str]:
+    """Lista de presupuestos incumplidos (vacía si todo está dentro)."""
+    fallos = []
+    if res["motores_cargados"]:
+        fallos.append(f"import horas carga {', '.join(res['motores_cargados'])}")
+    if import_budget is not None and res["import_ms"] > import_budget:
+        fallos.append(f"import horas: {res['import_ms']} ms > {import_budget:g} ms")
+    if arranque_budget is not None and res["arranque_ms"] > arranque_budget:
+        fallos.append(f"arranque de la CLI: {res['arranque_ms']} ms > {arranque_budget:g} ms")
+    return fallos
+
+def print_table(results: List[Dict], file=None):
+    file = file or sys.stdout
+    cols = ["recursos", "filas"] + STAGES + ["total", "pico_mb"]
+    print(" ".join(f"{c[:12]:>12}" for c in cols), file=file)
+    for r in results:
+        vals = [r["recursos"], r["filas"]] + [r["etapas"][k] for k in STAGES] + [r["total"], r["pico_mb"]]
+        print(" ".join(f"{v:>12}" for v in vals), file=file)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark por etapas del parser de horas")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="número de recursos")
+    ap.add_argument("--formato", choices=["xlsx", "xls"], default="xlsx")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--json", default=None, help="guardar también los resultados en JSON")
+    ap.add_argument("--arranque", action="store_true",
+                    help="solo mide el arranque y sale con 1 si se supera el presupuesto")
+    ap.add_argument("--import-budget", type=float, default=IMPORT_BUDGET_MS, metavar="MS",
+                    help="con --arranque, máximo para importar horas")
+    ap.add_argument("--arranque-budget", type=float, default=ARRANQUE_BUDGET_MS, metavar="MS",
+                    help="con --arranque, máximo para 'python horas.py --help'")
+    args = ap.parse_args(argv)
+    if args.arranque:
+        res = medir_arranque(max(args.repeat, 5))
+        print(f"import horas: {res['import_ms']} ms · arranque CLI: {res['arranque_ms']} ms")
+        fallos = comprobar_arranque(res, args.import_budget, args.arranque_budget)
+        for f in fallos:
+            print(f"FALLO: {f}", file=sys.stderr)
+        return 1 if fallos else 0
+    results = bench(args.sizes, args.formato, args.repeat)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
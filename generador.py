@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Generador de partes de horas sintéticos con el mismo formato que la exportación del ERP.
+
+Sirve para medir el parser sin usar nóminas reales:
+
+    python generador.py salida.xlsx --recursos 100
+    python generador.py salida.xls --recursos 1000 --dias 30 --semilla 7
+"""
+
+import os, random, argparse
+from typing import Iterator, List, Optional
+
+MESES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio",
+         "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+DOW = ["Lu", "Ma", "Mi", "Ju", "Vi", "Sá", "Do"]
+TIPOS = ["1 - HORA NORMAL", "2 - HORA EXTRA", "3 - HORA NOCTURNA", "4 - HORA FESTIVA"]
+
+DAY_START = 4  # columna D, como en las exportaciones reales
+
+def _fila(vals: dict, n_cols: int) -> List[Optional[object]]:
+    row = [None] * n_cols
+    for c, v in vals.items():
+        row[c-1] = v
+    return row
+
+def generate_rows(n_recursos: int, n_days: int = 31, mes: int = 10, anio: int = 2025,
+                  n_proyectos: int = 40, seed: int = 0, cabecera_cada: int = 25) -> Iterator[list]:
+    """Filas del parte: cabeceras, y por recurso la línea "602 - NOMBRE", "Proyectos:",
+    las filas de proyecto "25086 - NOMBRE" y sus imputaciones "N - HORA…".
+
+    Cada cabecera_cada recursos se repiten el banner del mes y las cabeceras, como
+    en los saltos de página de la exportación.
+    """
+    rnd = random.Random(seed)
+    n_cols = DAY_START + n_days
+    proyectos = [(f"{25000 + i:05d}", f"PROYECTO SINTÉTICO {i}") for i in range(n_proyectos)]
+    banner = f"{MESES[mes-1]} de {anio}"
+
+    def cabeceras():
+        yield _fila({DAY_START + 2: banner}, n_cols)
+        yield _fila({1: "Recurso", 2: "Tipo de hora", **{DAY_START + d - 1: d for d in range(1, n_days+1)}}, n_cols)
+        yield _fila({DAY_START + d - 1: DOW[(d-1) % 7] for d in range(1, n_days+1)}, n_cols)
+
+    def horas():
+        return {DAY_START + d - 1: f"{rnd.randint(1, 9):02d}:{rnd.choice(('00', '15', '30', '45'))}"
+                for d in range(1, n_days+1) if rnd.random() < 0.6}
+
+    yield _fila({1: "Listado de horas por recurso y proyecto"}, n_cols)
+    for i in range(n_recursos):
+        if i % cabecera_cada == 0:
+            yield from cabeceras()
+        yield _fila({1: f"{600 + i} - TRABAJADOR{i} APELLIDO{i % 97}"}, n_cols)
+        yield _fila({1: "Proyectos:"}, n_cols)
+        for cod, nom in rnd.sample(proyectos, rnd.randint(1, min(4, n_proyectos))):
+            tipos = sorted(rnd.sample(range(len(TIPOS)), rnd.randint(1, 3)))
+            if rnd.random() < 0.5:  # primera imputación en la misma fila del proyecto
+                yield _fila({1: f"{cod} - {nom}", 2: TIPOS[tipos.pop(0)], **horas()}, n_cols)
+            else:
+                yield _fila({1: f"{cod} - {nom}"}, n_cols)
+            for t in tipos:
+                yield _fila({rnd.choice((1, 2, 3)): TIPOS[t], **horas()}, n_cols)
+        yield _fila({}, n_cols)
+
+def generate(path: str, n_recursos: int, **kw) -> str:
+    """Escribe el parte en .xlsx (openpyxl) o .xls (xlwt, opcional)."""
+    ext = os.path.splitext(path)[1].lower()
+    rows = generate_rows(n_recursos, **kw)
+    if ext == ".xlsx":
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Hoja1")
+        for row in rows:
+            ws.append(row)
+        wb.save(path)
+    elif ext == ".xls":
+        try:
+            import xlwt
+        except ImportError as e:
+            raise RuntimeError("Para generar .xls hace falta xlwt (pip install xlwt).") from e
+        wb = xlwt.Workbook()
+        ws = wb.add_sheet("Hoja1")
+        for r, row in enumerate(rows):
+            if r >= 65536:
+                raise RuntimeError("Un .xls admite como máximo 65536 filas; usa .xlsx o menos recursos.")
+            for c, v in enumerate(row):
+                if v is not None:
+                    ws.write(r, c, v)
+        wb.save(path)
+    else:
+        raise ValueError("Extensión no soportada")
+    return path
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Genera un parte de horas sintético")
+    ap.add_argument("salida", help="fichero .xlsx o .xls a crear")
+    ap.add_argument("--recursos", type=int, default=100)
+    ap.add_argument("--dias", type=int, default=31, choices=range(28, 32), metavar="28-31")
+    ap.add_argument("--proyectos", type=int, default=40)
+    ap.add_argument("--semilla", type=int, default=0)
+    args = ap.parse_args(argv)
+    generate(args.salida, args.recursos, n_days=args.dias, n_proyectos=args.proyectos, seed=args.semilla)
+    print(args.salida)
+
+if __name__ == "__main__":
+    main()
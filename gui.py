@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Interfaz de escritorio (Tkinter) del transformador Excel → IPI.
+
+Vive aparte para que importar horas (CLI, lotes, procesos de trabajo y la
+versión web) no cargue Tkinter; horas.main() la importa al abrir la ventana.
+"""
+
+import os
+from concurrent.futures import CancelledError
+
+import tkinter as tk
+from tkinter import filedialog, messagebox, ttk
+
+from horas import (Persist, Progreso, Cancelado, Informe, JobManager, PARSE_CACHE,
+                   MODOS_MULTIHOJA, collect_discovered, describir_conflictos, parse_libro, process_file)
+
+SOLO_ACTIVA = "Solo la hoja activa"
+
+class ListaMarcas(ttk.Frame):
+    """Treeview con búsqueda y columnas de marca que se conmutan con un clic.
+
+    filas: {clave: (texto, …)}; estado: {clave: [bool, …]}, una marca por
+    columna de marcas, que se modifica en sitio. Con exclusivas, marcar una
+    columna desmarca las demás de la fila. Solo se insertan en el árbol las
+    filas que casan con la búsqueda.
+    """
+    MARCA = {True: "☑", False: "☐"}
+
+    def __init__(self, parent, cabeceras, marcas, filas, estado, exclusivas=False, anchos=None):
+        super().__init__(parent)
+        self.filas = filas
+        self.estado = estado
+        self.exclusivas = exclusivas
+        self.n_textos = len(cabeceras)
+        self._pendiente = None
+
+        top = ttk.Frame(self); top.pack(fill="x", pady=(0, 4))
+        ttk.Label(top, text="Buscar:").pack(side="left")
+        self.q = tk.StringVar()
+        ttk.Entry(top, textvariable=self.q).pack(side="left", fill="x", expand=True, padx=6)
+        self.info = ttk.Label(top); self.info.pack(side="left")
+        self.q.trace_add("write", self._programar_filtro)
+
+        cols = list(cabeceras) + list(marcas)
+        body = ttk.Frame(self); body.pack(fill="both", expand=True)
+        self.tree = ttk.Treeview(body, columns=[f"c{i}" for i in range(len(cols))], show="headings",
+                                 selectmode="extended")
+        anchos = anchos or [120] * self.n_textos
+        for i, titulo in enumerate(cols):
+            marca = i >= self.n_textos
+            self.tree.heading(f"c{i}", text=titulo)
+            self.tree.column(f"c{i}", width=110 if marca else anchos[i], anchor="center" if marca else "w",
+                             stretch=not marca)
+        v = ttk.Scrollbar(body, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=v.set)
+        v.pack(side="right", fill="y"); self.tree.pack(side="left", fill="both", expand=True)
+        self.tree.bind("<Button-1>", self._on_click)
+        self.tree.bind("<space>", lambda e: self._conmutar_seleccion(0))
+        self.filtrar()
+
+    def _valores(self, k):
+        return tuple(self.filas[k]) + tuple(self.MARCA[m] for m in self.estado[k])
+
+    def _programar_filtro(self, *_):
+        if self._pendiente is not None:
+            self.after_cancel(self._pendiente)
+        self._pendiente = self.after(150, self.filtrar)
+
+    def filtrar(self):
+        self._pendiente = None
+        q = self.q.get().strip().lower()
+        self.tree.delete(*self.tree.get_children())
+        n = 0
+        for k, textos in self.filas.items():
+            if not q or any(q in t.lower() for t in textos):
+                self.tree.insert("", "end", iid=k, values=self._valores(k))
+                n += 1
+        self.info.configure(text=f"{n} de {len(self.filas)}")
+
+    def conmutar(self, k, j):
+        marcas = self.estado[k]
+        marcas[j] = not marcas[j]
+        if self.exclusivas and marcas[j]:
+            for i in range(len(marcas)):
+                if i != j:
+                    marcas[i] = False
+        self.tree.item(k, values=self._valores(k))
+
+    def _on_click(self, event):
+        if self.tree.identify_region(event.x, event.y) != "cell":
+            return
+        k = self.tree.identify_row(event.y)
+        j = int(self.tree.identify_column(event.x)[1:]) - 1 - self.n_textos
+        if k and j >= 0:
+            self.conmutar(k, j)
+            return "break"
+
+    def _conmutar_seleccion(self, j):
+        for k in self.tree.selection():
+            self.conmutar(k, j)
+        return "break"
+
+class App(tk.Tk):
+    def __init__(self):
+        super().__init__()
+        self.title("Transformador Excel → IPI")
+        self.geometry("980x560")
+        self.persist = Persist.load()
+        self.input_path = tk.StringVar(value="")
+        self.hojas = tk.StringVar(value=SOLO_ACTIVA)
+        self._parsed = None       # (ruta, mtime, tamaño, multihoja, ParsedSheet/ParsedLibro) del último Excel leído
+        self.jobs = JobManager(max_workers=1, max_pending=1)
+        self._job = None          # (id, al terminar) del trabajo en curso
+        self._build()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        if self.persist.conflictos_importados:
+            self.after(0, lambda: messagebox.showwarning(
+                "Clasificación importada", describir_conflictos(self.persist.conflictos_importados)))
+
+    def _firma(self):
+        path = self.input_path.get()
+        st = os.stat(path)
+        return (path, st.st_mtime_ns, st.st_size, self._multihoja() is not None)
+
+    def _multihoja(self):
+        """Modo de MODOS_MULTIHOJA elegido, o None para solo la hoja activa."""
+        return next((k for k, v in MODOS_MULTIHOJA.items() if v == self.hojas.get()), None)
+
+    def _con_parsed(self, continuar):
+        """Llama a continuar(parsed) con el ParsedSheet (o ParsedLibro, con varias
+        hojas) del Excel seleccionado.
+
+        Si el fichero no ha cambiado se reutiliza el último; si no, se parsea en
+        el hilo de trabajo y se continúa al terminar.
+        """
+        try:
+            firma = self._firma()
+        except OSError as e:
+            messagebox.showerror("Error", str(e)); return
+        if self._parsed is not None and self._parsed[:4] == firma:
+            continuar(self._parsed[4]); return
+
+        def hecho(parsed):
+            self._parsed = firma + (parsed,)
+            collect_discovered(parsed.recursos, parsed.proyectos, self.persist)
+            continuar(parsed)
+        self._run("Leyendo Excel", _parse_en_hilo, firma[0], firma[3], al_terminar=hecho)
+
+    def _build(self):
+        frm = ttk.Frame(self, padding=10); frm.pack(fill="both", expand=True)
+        row0 = ttk.Frame(frm); row0.pack(fill="x", pady=(0, 8))
+        ttk.Label(row0, text="Archivo Excel (.xlsx/.xls):").pack(side="left")
+        ttk.Entry(row0, textvariable=self.input_path, width=80).pack(side="left", padx=6, fill="x", expand=True)
+        ttk.Button(row0, text="Explorar…", command=self.on_browse).pack(side="left")
+        row_h = ttk.Frame(frm); row_h.pack(fill="x", pady=(0, 8))
+        ttk.Label(row_h, text="Hojas:").pack(side="left")
+        ttk.Combobox(row_h, textvariable=self.hojas, state="readonly", width=44,
+                     values=[SOLO_ACTIVA] + list(MODOS_MULTIHOJA.values())).pack(side="left", padx=6)
+        row1 = ttk.Frame(frm); row1.pack(fill="x", pady=(0, 8))
+        self._acciones = [
+            ttk.Button(row1, text="Clasificar proyectos…", command=self.on_edit_clasif),
+            ttk.Button(row1, text="Definir exclusiones…", command=self.on_edit_excl),
+            ttk.Button(row1, text="Procesar y generar IPI", command=self.on_process),
+        ]
+        for b, pad in zip(self._acciones, (0, 6, 12)):
+            b.pack(side="left", padx=pad)
+        ttk.Label(frm, text="1) Selecciona Excel. 2) Clasifica y excluye. 3) Genera IPI.").pack(anchor="w", pady=(12, 0))
+
+        status = ttk.Frame(frm); status.pack(side="bottom", fill="x")
+        self.barra = ttk.Progressbar(status, mode="determinate", maximum=1.0)
+        self.barra.pack(side="left", fill="x", expand=True)
+        self.estado = ttk.Label(status, text="", width=40); self.estado.pack(side="left", padx=8)
+        self.btn_cancelar = ttk.Button(status, text="Cancelar", command=self.on_cancel, state="disabled")
+        self.btn_cancelar.pack(side="left")
+
+    # ---------- Trabajo en segundo plano ----------
+
+    def _run(self, titulo, fn, *args, al_terminar=None, **kwargs):
+        """Ejecuta fn en el hilo de trabajo (recibe progreso=) y sondea con after()."""
+        if self._job is not None:
+            messagebox.showinfo("Aviso", "Ya hay un trabajo en curso."); return
+        for b in self._acciones:
+            b.configure(state="disabled")
+        self.btn_cancelar.configure(state="normal")
+        self.estado.configure(text=titulo)
+        self._job = (self.jobs.submit(fn, *args, **kwargs), al_terminar)
+        self.after(100, self._poll)
+
+    def _poll(self):
+        job_id, al_terminar = self._job
+        job = self.jobs.get(job_id)
+        if not job.done():
+            p = job.progreso
+            if p.total:
+                self.barra.configure(mode="determinate", value=p.fraccion())
+            else:
+                self.barra.configure(mode="indeterminate"); self.barra.step(0.05)
+            self.estado.configure(text=p.texto())
+            self.after(100, self._poll)
+            return
+        self.jobs.forget(job_id)
+        self._job = None
+        for b in self._acciones:
+            b.configure(state="normal")
+        self.btn_cancelar.configure(state="disabled")
+        self.barra.configure(mode="determinate", value=0)
+        try:
+            res = job.result()
+        except (Cancelado, CancelledError):
+            self.estado.configure(text="Cancelado"); return
+        except Exception as e:
+            self.estado.configure(text="Error")
+            messagebox.showerror("Error", str(e)); return
+        self.estado.configure(text="")
+        if al_terminar:
+            al_terminar(res)
+
+    def on_cancel(self):
+        if self._job is not None:
+            self.jobs.cancel(self._job[0])
+            self.estado.configure(text="Cancelando…")
+
+    def on_close(self):
+        self.on_cancel()
+        self.destroy()
+
+    # ---------- Acciones ----------
+
+    def on_browse(self):
+        p = filedialog.askopenfilename(title="Selecciona Excel",
+                                       filetypes=[("Excel", "*.xlsx *.xls"), ("Todos", "*.*")])
+        if p:
+            self.input_path.set(p)
+
+    def on_edit_clasif(self):
+        proys = sorted(self.persist.tipos.keys())
+        if not proys:
+            messagebox.showinfo("Aviso", "No hay proyectos detectados. Carga un Excel primero."); return
+        dlg = tk.Toplevel(self); dlg.title("Clasificación de proyectos"); dlg.geometry("760x560")
+        container = ttk.Frame(dlg, padding=10); container.pack(fill="both", expand=True)
+        ttk.Label(container, text="Clic en una casilla para marcarla; espacio marca CONSTRUCCIÓN en la selección.").pack(anchor="w")
+        filas = {cod: (cod, self.persist.nombres.get(cod, "")) for cod in proys}
+        estado = {cod: [self.persist.tipos.get(cod, "") == "CONSTRUCCION",
+                        self.persist.tipos.get(cod, "") == "REPARACION"] for cod in proys}
+        lista = ListaMarcas(container, ["CÓDIGO", "NOMBRE"], ["CONSTRUCCIÓN", "REPARACIÓN"],
+                            filas, estado, exclusivas=True, anchos=[90, 400])
+        lista.pack(fill="both", expand=True)
+        def save_close():
+            for cod, (con, rep) in estado.items():
+                tipo = "CONSTRUCCION" if con else "REPARACION" if rep else ""
+                if self.persist.tipos.get(cod, "") != tipo:
+                    self.persist.tipos[cod] = tipo
+            self.persist.asked_clasif = True; self.persist.save(); dlg.destroy()
+        ttk.Button(container, text="Guardar", command=save_close).pack(pady=8)
+
+    def on_edit_excl(self):
+        if not self.input_path.get():
+            messagebox.showwarning("Atención", "Selecciona primero un archivo Excel."); return
+        self._con_parsed(self._dialogo_excl)
+
+    def _dialogo_excl(self, parsed):
+        recursos, proyectos = parsed.discovered()
+        excl_r, excl_p = set(self.persist.excluir_recursos), set(self.persist.excluir_proyectos)
+        dlg = tk.Toplevel(self); dlg.title("Exclusiones persistentes"); dlg.geometry("980x620")
+        container = ttk.Frame(dlg, padding=10); container.pack(fill="both", expand=True)
+        ttk.Button(container, text="Guardar exclusiones",
+                   command=lambda: save_close()).pack(side="bottom", pady=8)
+        lf1 = ttk.Labelframe(container, text="Recursos a excluir"); lf1.pack(side="left", fill="both", expand=True, padx=(0, 6))
+        claves_r = sorted(set(recursos) | excl_r)
+        est_r = {r: [r in excl_r] for r in claves_r}
+        ListaMarcas(lf1, ["RECURSO"], ["EXCLUIR"], {r: (r,) for r in claves_r}, est_r,
+                    anchos=[320]).pack(fill="both", expand=True)
+        lf2 = ttk.Labelframe(container, text="Proyectos a excluir"); lf2.pack(side="left", fill="both", expand=True, padx=(6, 0))
+        claves_p = sorted(set(proyectos) | excl_p)
+        est_p = {c: [c in excl_p] for c in claves_p}
+        ListaMarcas(lf2, ["CÓDIGO", "NOMBRE"], ["EXCLUIR"],
+                    {c: (c, proyectos.get(c) or self.persist.nombres.get(c, "")) for c in claves_p}, est_p,
+                    anchos=[80, 260]).pack(fill="both", expand=True)
+        def save_close():
+            self.persist.excluir_recursos  = [k for k, v in est_r.items() if v[0]]
+            self.persist.excluir_proyectos = [k for k, v in est_p.items() if v[0]]
+            self.persist.asked_excl = True; self.persist.save(); dlg.destroy()
+
+    def _ensure_prompts(self):
+        need_class = any(v == "" for v in self.persist.tipos.values())
+        if need_class or not self.persist.asked_clasif:
+            if messagebox.askyesno("Clasificar proyectos", "Hay proyectos sin tipo o es la primera vez. ¿Clasificar ahora?"):
+                self.on_edit_clasif()
+            else:
+                self.persist.asked_clasif = True; self.persist.save()
+        if not self.persist.asked_excl:
+            if messagebox.askyesno("Definir exclusiones", "¿Quieres definir exclusiones ahora?"):
+                self.on_edit_excl()
+            else:
+                self.persist.asked_excl = True; self.persist.save()
+
+    def on_process(self):
+        if not self.input_path.get():
+            messagebox.showwarning("Atención", "Selecciona un archivo primero."); return
+        path = self.input_path.get()
+
+        def procesar(parsed):
+            self._ensure_prompts()
+            # El hilo trabaja sobre una instantánea: la interfaz sigue pudiendo editar persist.
+            self._run("Generando IPI", process_file, path, self.persist.snapshot(), parsed=parsed,
+                      multihoja=self._multihoja(), al_terminar=lambda informe: messagebox.showinfo("Listo", f"Generado:\n{informe.salida}"))
+        self._con_parsed(procesar)
+
+def _parse_en_hilo(path: str, multihoja: bool, progreso: Progreso):
+    informe = Informe(enabled=False, progreso=progreso)
+    if multihoja:
+        return parse_libro(path, informe=informe)  # sin exclusiones: se aplican al procesar
+    return PARSE_CACHE.parse_path(path, informe)
@@ -1,20 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, re, json, tempfile
+import io, os, re, sys, abc, csv, json, glob, time, itertools, importlib.util, sqlite3, tempfile, hashlib, pickle, threading, argparse, uuid, multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional, Tuple
+from functools import lru_cache
+from typing import Iterator, List, Dict, NamedTuple, Optional, Tuple
 
-# --- Tkinter opcional ---
-try:
-    import tkinter as tk
-    from tkinter import filedialog, messagebox, ttk
-except Exception:
-    tk = None
-    filedialog = messagebox = ttk = None
+import numpy as np
 
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+# openpyxl, xlrd, pyarrow, Tkinter (gui.py) y win32com se importan en la función que
+# los usa: importar horas debe ser barato para la CLI, los procesos de trabajo y la web.
 
 # ======================================================================================
 # Configuración
@@ -24,6 +21,8 @@ JSON_PATH = os.environ.get(
     "JSON_PATH",
     os.path.join(os.path.dirname(__file__), "clasificacion_proyectos.json"),
 )
+# Almacén real; el JSON solo se importa la primera vez que se crea la base de datos.
+DB_PATH = os.environ.get("DB_PATH", os.path.splitext(JSON_PATH)[0] + ".sqlite3")
 SHEET_SALIDA = "IPI"
 
 COLOR_HEADER       = "D9D9D9"  # gris
@@ -35,8 +34,12 @@ RE_COD_PROY      = re.compile(r"^\s*(\d{5})\s*[-–]\s*(.+)$", re.U)
 RE_TIPO_HORA     = re.compile(r"^\s*\d+\s*-\s*HORA", re.I)
 RE_HHMM          = re.compile(r"^\s*(\d{1,2})\s*:\s*([0-5]\d)\s*$")
 RE_RECURSO       = re.compile(r"^\s*\d+\s*[-–]\s+\S+", re.U)  # p.ej. "602 - NOMBRE"
+RE_COD_PROY_ALT  = re.compile(r"^\s*(\d{5})\s+(.*)$")         # "25086 NOMBRE", sin guion
+RE_TIPO_IDX      = re.compile(r"^\s*(\d+)\s*-\s*")
+RE_ESPACIOS      = re.compile(r"\s+")
 
-GUI_ENABLED = tk is not None
+# Tkinter opcional: la interfaz está en gui.py y solo se importa al abrirla.
+GUI_ENABLED = importlib.util.find_spec("tkinter") is not None
 
 # ======================================================================================
 # Utilidades
@@ -45,10 +48,7 @@ GUI_ENABLED = tk is not None
 def hhmm_to_minutes(text: str) -> int:
     if not text:
         return 0
-    m = RE_HHMM.match(str(text))
-    if not m:
-        return 0
-    return int(m.group(1)) * 60 + int(m.group(2))
+    return classify_cell(text if isinstance(text, str) else str(text)).minutos
 
 def minutes_to_hhmm(total_min: int) -> str:
     return f"{total_min//60:02d}:{total_min%60:02d}"
@@ -56,20 +56,59 @@ def minutes_to_hhmm(total_min: int) -> str:
 def normalize_project(text: str) -> Optional[Tuple[str, str]]:
     if not text:
         return None
-    s = str(text).strip()
-    m = RE_COD_PROY.match(s)
-    if m:
-        return m.group(1), m.group(2).strip()
-    m2 = re.match(r"^\s*(\d{5})\s+(.*)$", s)
-    if m2:
-        return m2.group(1), m2.group(2).strip()
-    return None
+    tok = classify_cell(text if isinstance(text, str) else str(text))
+    return (tok.codigo, tok.nombre) if tok.flags & K_PROYECTO else None
+
+def tipo_index(text: str) -> int:
+    """Número de la imputación "N - HORA…" (0 si no lo tiene)."""
+    return classify_cell(text).tipo_idx if text else 0
 
 def read_cell(ws, r, c):
-    v = ws.cell(row=r, column=c).value
-    if v is None:
-        return ""
-    return v.strip() if isinstance(v, str) else str(v).strip()
+    return ws.value(r, c)
+
+# ======================================================================================
+# Hoja en memoria
+# ======================================================================================
+
+class SheetGrid:
+    """Hoja activa cargada de una vez como cuadrícula de textos ya normalizados.
+
+    Las filas se guardan como tuplas sin las celdas vacías del final; los índices
+    son 1-based como en openpyxl y fuera de rango se devuelve "".
+    """
+    __slots__ = ("rows", "max_row", "max_column")
+
+    def __init__(self, rows: List[Tuple[str, ...]]):
+        self.rows = rows
+        self.max_row = len(rows)
+        self.max_column = max((len(x) for x in rows), default=0)
+
+    def value(self, r: int, c: int) -> str:
+        if r < 1 or c < 1 or r > self.max_row:
+            return ""
+        row = self.rows[r-1]
+        return row[c-1] if c <= len(row) else ""
+
+    def row(self, r: int) -> Tuple[str, ...]:
+        return self.rows[r-1] if 1 <= r <= self.max_row else ()
+
+def _normalize_values(values, seen: Dict[str, str]) -> Tuple[str, ...]:
+    out = []
+    for v in values:
+        if v is None:
+            out.append("")
+            continue
+        t = v.strip() if isinstance(v, str) else str(v).strip()
+        out.append(seen.setdefault(t, t))  # misma cadena para textos repetidos
+    while out and not out[-1]:
+        out.pop()
+    return tuple(out)
+
+def load_grid(src) -> SheetGrid:
+    """Vuelca un SheetReader (o una hoja openpyxl) en un SheetGrid."""
+    rows = src.iter_values() if isinstance(src, SheetReader) else src.iter_rows(values_only=True)
+    seen: Dict[str, str] = {}
+    return SheetGrid([_normalize_values(row, seen) for row in rows])
 
 # ======================================================================================
 # Filtro de filas “basura”
@@ -82,31 +121,161 @@ MONTHS_ES = [
 RE_MONTH_BANNER = re.compile(rf"^\s*({'|'.join(MONTHS_ES)})\s+de\s+\d{{4}}\s*$", re.I)
 DOW_TOKENS = {"lu","lu.","ma","ma.","mi","mi.","ju","ju.","vi","vi.","sá","sá.","sa","sa.","do","do.","dom","dom."}
 
-def _row_has_month_banner(ws, r:int)->bool:
-    for c in range(1, ws.max_column+1):
-        if RE_MONTH_BANNER.match(read_cell(ws, r, c) or ""):
-            return True
-    return False
+# ======================================================================================
+# Clasificador de celdas
+# ======================================================================================
+
+K_TAG      = 0x01
+K_BANNER   = 0x02
+K_DOW      = 0x04
+K_PROYECTO = 0x08
+K_TIPO     = 0x10
+K_HHMM     = 0x20
+
+class Token(NamedTuple):
+    """Clasificación de un texto de celda; un mismo texto devuelve siempre el mismo objeto."""
+    flags: int = 0
+    codigo: Optional[str] = None   # K_PROYECTO
+    nombre: Optional[str] = None
+    tipo_idx: int = 0              # K_TIPO
+    minutos: int = 0               # K_HHMM
+
+TOKEN_OTRO = Token()
+TOKEN_CACHE_SIZE = 1 << 16
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def classify_cell(text: str) -> Token:
+    """Clasifica un texto de celda una sola vez (caché LRU acotada).
+
+    Cubre todo lo que miran los parsers: etiqueta "Proyectos:", banner de mes,
+    día de la semana, código de proyecto, imputación "N - HORA…" y "HH:MM".
+    """
+    s = text.strip()
+    if not s:
+        return TOKEN_OTRO
+    flags = 0; codigo = nombre = None; tipo_idx = minutos = 0
+    m = RE_HHMM.match(s)
+    if m:
+        flags |= K_HHMM; minutos = int(m.group(1)) * 60 + int(m.group(2))
+    elif s.lower() in DOW_TOKENS:
+        flags |= K_DOW
+    elif RE_PROYECTOS_TAG.match(s):
+        flags |= K_TAG
+    elif RE_MONTH_BANNER.match(s):
+        flags |= K_BANNER
+    else:
+        m = RE_COD_PROY.match(s) or RE_COD_PROY_ALT.match(s)
+        if m:
+            flags |= K_PROYECTO; codigo = sys.intern(m.group(1)); nombre = m.group(2).strip()
+        if RE_TIPO_HORA.match(s):
+            flags |= K_TIPO; tipo_idx = int(RE_TIPO_IDX.match(s).group(1))
+    return Token(flags, codigo, nombre, tipo_idx, minutos) if flags else TOKEN_OTRO
+
+def token_cache_stats() -> Tuple[int, int]:
+    """(aciertos, fallos) acumulados de la caché de classify_cell."""
+    info = classify_cell.cache_info()
+    return info.hits, info.misses
+
+# ======================================================================================
+# Índice de filas (una sola pasada)
+# ======================================================================================
 
-def _row_is_header_recurso(ws, r:int)->bool:
-    a = (read_cell(ws, r, 1) or "").lower()
-    b = (read_cell(ws, r, 2) or "").lower()
-    return a.startswith("recurso") and b.startswith("tipo")
+F_TAG          = 0x01  # celda "Proyectos:"
+F_BANNER       = 0x02  # "Octubre de 2025"
+F_HDR_RECURSO  = 0x04  # cabecera "Recurso | Tipo…"
+F_HDR_DOW      = 0x08  # fila de días de la semana
+F_GARBAGE      = F_BANNER | F_HDR_RECURSO | F_HDR_DOW
+
+class RowIndex:
+    """Rasgos de cada fila calculados en un único recorrido de la hoja.
+
+    - flags[r]: combinación de F_* (bytearray 1-based).
+    - proyecto[r]: (código, nombre, columna) de la primera celda de A/B con código.
+    - tipos[r]: ((columna, texto), …) de las celdas A–D que casan RE_TIPO_HORA.
+    - recurso_de_tag[r]: línea de recurso válida más cercana por encima de cada
+      fila "Proyectos:", saltando cabeceras y basura.
+    """
+    __slots__ = ("n_days", "day_start", "flags", "proyecto", "tipos", "recurso_de_tag", "tags")
+
+    def __init__(self, n_days: int, day_start: int, max_row: int):
+        self.n_days = n_days
+        self.day_start = day_start
+        self.flags = bytearray(max_row + 1)
+        self.proyecto: Dict[int, Tuple[str, str, int]] = {}
+        self.tipos: Dict[int, Tuple[Tuple[int, str], ...]] = {}
+        self.recurso_de_tag: Dict[int, str] = {}
+        self.tags: List[int] = []
+
+    def is_garbage(self, r: int) -> bool:
+        return bool(self.flags[r] & F_GARBAGE)
+
+    def first_tipo(self, r: int, cols=(1, 2, 3)) -> Optional[str]:
+        return _first_tipo(self.tipos.get(r), cols)
+
+def _first_tipo(found, cols=(1, 2, 3)) -> Optional[str]:
+    if not found:
+        return None
+    for c in cols:
+        for col, t in found:
+            if col == c:
+                return t
+    return None
 
-def _row_is_header_dow(ws, r:int, day_start:int, n_days:int)->bool:
+def _rasgos_fila(row: Tuple[str, ...], day_start: int, n_days: int):
+    """(flags F_*, proyecto, tipos) de una fila normalizada, como en RowIndex."""
+    f = 0
+    for v in row:
+        if v:
+            k = classify_cell(v).flags
+            if k & K_TAG:
+                f |= F_TAG
+            if k & K_BANNER:
+                f |= F_BANNER
+    a = row[0].lower() if row else ""
+    b = row[1].lower() if len(row) > 1 else ""
+    if a.startswith("recurso") and b.startswith("tipo"):
+        f |= F_HDR_RECURSO
     cnt = 0
-    for c in range(day_start, min(ws.max_column, day_start + n_days - 1) + 1):
-        v = (read_cell(ws, r, c) or "").strip().lower()
-        if v in DOW_TOKENS:
+    for v in row[day_start-1:day_start-1+n_days]:
+        if v and classify_cell(v).flags & K_DOW:
             cnt += 1
-    return cnt >= 5
-
-def is_garbage_row(ws, r:int, day_start:int, n_days:int)->bool:
-    return (
-        _row_has_month_banner(ws, r) or
-        _row_is_header_recurso(ws, r) or
-        _row_is_header_dow(ws, r, day_start, n_days)
-    )
+    if cnt >= 5:
+        f |= F_HDR_DOW
+
+    proyecto = None
+    for c in (1, 2):
+        tok = classify_cell(row[c-1]) if c <= len(row) and row[c-1] else TOKEN_OTRO
+        if tok.flags & K_PROYECTO:
+            proyecto = (tok.codigo, tok.nombre, c)
+            break
+
+    tipos = tuple((c, row[c-1]) for c in range(1, min(4, len(row)) + 1)
+                  if row[c-1] and classify_cell(row[c-1]).flags & K_TIPO)
+    return f, proyecto, tipos or None
+
+def _linea_recurso(row: Tuple[str, ...]) -> Optional[str]:
+    s = RE_ESPACIOS.sub(" ", " ".join([p for p in row[:6] if p])).strip()
+    return s if RE_RECURSO.match(s) else None
+
+def build_row_index(ws, n_days: int, day_start: int) -> RowIndex:
+    idx = RowIndex(n_days, day_start, ws.max_row)
+    flags = idx.flags
+    recurso_previo = None
+    for r, row in enumerate(ws.rows, start=1):
+        f, proyecto, tipos = _rasgos_fila(row, day_start, n_days)
+        flags[r] = f
+
+        if f & F_TAG:
+            idx.tags.append(r)
+            idx.recurso_de_tag[r] = recurso_previo or "RECURSO DESCONOCIDO"
+        if proyecto:
+            idx.proyecto[r] = proyecto
+        if tipos:
+            idx.tipos[r] = tipos
+
+        if not f & F_GARBAGE:
+            recurso_previo = _linea_recurso(row) or recurso_previo
+    return idx
 
 # ======================================================================================
 # Datos
@@ -121,83 +290,391 @@ class RowData:
     tipo_imputacion: Optional[str] = None
     horas_por_dia: List[str] = field(default_factory=list)
 
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tipos       (codigo TEXT PRIMARY KEY, tipo TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS nombres     (codigo TEXT PRIMARY KEY, nombre TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS exclusiones (clase TEXT NOT NULL, clave TEXT NOT NULL, PRIMARY KEY (clase, clave));
+CREATE TABLE IF NOT EXISTS meta        (clave TEXT PRIMARY KEY, valor TEXT NOT NULL);
+"""
+
+def _connect() -> sqlite3.Connection:
+    con = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.executescript(_SCHEMA)
+    return con
+
+def _import_json(d: Dict) -> Dict:
+    """Normaliza el JSON actual y el antiguo (mapa "clasif" anidado por "código-nombre").
+
+    La aplicación antigua cargaba el fichero entero como mapa de clasificación,
+    añadía detrás las clasificaciones nuevas y lo guardaba bajo "clasif": cada
+    nivel exterior es posterior al que anida, así que gana el más exterior. Los
+    códigos con otro tipo en un nivel anidado se devuelven en "conflictos"
+    (código -> (tipo conservado, tipo descartado)) para revisarlos.
+    """
+    tipos = dict(d.get("tipos", {})); nombres = dict(d.get("nombres", {}))
+    excl_p = list(d.get("excluir_proyectos", [])); excl_r = list(d.get("excluir_recursos", []))
+    excl = d.get("excl") if isinstance(d.get("excl"), dict) else {}
+    excl_r += excl.get("recursos", [])
+    excl_p += [p[0] if p else k for k, p in ((k, normalize_project(k)) for k in excl.get("proyectos", []))]
+
+    conflictos: Dict[str, Tuple[str, str]] = {}
+    pending = [d["clasif"]] if isinstance(d.get("clasif"), dict) else []
+    while pending:  # del nivel exterior al más anidado; el primero que aparece gana
+        m = pending.pop(0)
+        for k, v in m.items():
+            if isinstance(v, dict):
+                pending.append(v)
+            elif k == "excl_recursos":
+                excl_r += v
+            elif k == "excl_proyectos":
+                excl_p += [p[0] if p else k2 for k2, p in ((k2, normalize_project(k2)) for k2 in v)]
+            elif isinstance(v, str):
+                p = normalize_project(k)
+                if p:
+                    tipo = tipos.setdefault(p[0], v)
+                    if tipo != v:
+                        conflictos.setdefault(p[0], (tipo, v))
+                    nombres.setdefault(p[0], p[1])
+    return {
+        "tipos": tipos, "nombres": nombres,
+        "excluir_proyectos": list(dict.fromkeys(excl_p)),
+        "excluir_recursos": list(dict.fromkeys(excl_r)),
+        "asked_clasif": bool(d.get("asked_clasif", False)),
+        "asked_excl": bool(d.get("asked_excl", False)),
+        "conflictos": conflictos,
+    }
+
+def describir_conflictos(conflictos: Dict[str, Tuple[str, str]]) -> str:
+    """Aviso legible para los conflictos que devuelve _import_json."""
+    return (f"{len(conflictos)} proyectos tenían dos clasificaciones en {os.path.basename(JSON_PATH)}; "
+            "se ha conservado la más reciente. Revísalos: "
+            + ", ".join(f"{c} ({t}, antes {t0})" for c, (t, t0) in sorted(conflictos.items())))
+
 @dataclass
 class Persist:
+    """Clasificación y exclusiones persistentes, guardadas en SQLite (WAL).
+
+    save() solo escribe las claves que han cambiado desde la última carga, en
+    una transacción, así que dos sesiones que editan claves distintas no se
+    pisan. refresh() recarga solo si otro proceso ha guardado entretanto.
+    """
     tipos: Dict[str, str] = field(default_factory=dict)      # codigo -> tipo
     nombres: Dict[str, str] = field(default_factory=dict)    # codigo -> nombre
     excluir_proyectos: List[str] = field(default_factory=list)
     excluir_recursos: List[str] = field(default_factory=list)
     asked_clasif: bool = False
     asked_excl: bool = False
+    readonly: bool = field(default=False, repr=False)  # instantánea: save() no escribe
+    _base: Optional[Dict] = field(default=None, repr=False, compare=False)
+    _version: int = field(default=-1, repr=False, compare=False)
+    # Del JSON antiguo, solo en el load() que lo importó: código -> (tipo conservado, descartado)
+    conflictos_importados: Dict[str, Tuple[str, str]] = field(default_factory=dict, repr=False, compare=False)
+
+    def snapshot(self) -> "Persist":
+        """Copia de solo lectura para procesos de trabajo que no deben tocar la base de datos."""
+        return Persist(dict(self.tipos), dict(self.nombres), list(self.excluir_proyectos),
+                       list(self.excluir_recursos), self.asked_clasif, self.asked_excl, readonly=True)
+
+    def _state(self) -> Dict:
+        return {
+            "tipos": dict(self.tipos), "nombres": dict(self.nombres),
+            "excluir_proyectos": set(self.excluir_proyectos),
+            "excluir_recursos": set(self.excluir_recursos),
+            "asked_clasif": self.asked_clasif, "asked_excl": self.asked_excl,
+        }
+
+    @staticmethod
+    def _read_version(con) -> int:
+        row = con.execute("SELECT valor FROM meta WHERE clave='version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _read(self, con):
+        self.tipos = dict(con.execute("SELECT codigo, tipo FROM tipos"))
+        self.nombres = dict(con.execute("SELECT codigo, nombre FROM nombres"))
+        excl = con.execute("SELECT clase, clave FROM exclusiones ORDER BY rowid").fetchall()
+        self.excluir_proyectos = [k for c, k in excl if c == "proyecto"]
+        self.excluir_recursos = [k for c, k in excl if c == "recurso"]
+        meta = dict(con.execute("SELECT clave, valor FROM meta"))
+        self.asked_clasif = meta.get("asked_clasif") == "1"
+        self.asked_excl = meta.get("asked_excl") == "1"
+        self._version = int(meta.get("version", 0))
+        self._base = self._state()
 
     @classmethod
     def load(cls):
-        if not os.path.exists(JSON_PATH):
-            return cls()
+        obj = cls()
+        con = _connect()
         try:
-            with open(JSON_PATH, "r", encoding="utf-8") as f:
-                d = json.load(f)
-            obj = cls()
-            obj.tipos = d.get("tipos", {})
-            obj.nombres = d.get("nombres", {})
-            obj.excluir_proyectos = d.get("excluir_proyectos", [])
-            obj.excluir_recursos = d.get("excluir_recursos", [])
-            obj.asked_clasif = d.get("asked_clasif", False)
-            obj.asked_excl = d.get("asked_excl", False)
-            return obj
-        except Exception:
-            return cls()
+            if cls._read_version(con) == 0 and os.path.exists(JSON_PATH):
+                try:
+                    with open(JSON_PATH, "r", encoding="utf-8") as f:
+                        d = _import_json(json.load(f))
+                except (OSError, ValueError) as e:
+                    raise RuntimeError(f"No se pudo importar {JSON_PATH}: {e}") from e
+                obj.conflictos_importados = d.pop("conflictos")
+                imp = cls(**d)
+                imp._base = cls()._state()
+                imp._write(con)
+            obj._read(con)
+        finally:
+            con.close()
+        return obj
+
+    def refresh(self) -> bool:
+        """Recarga desde la base de datos si ha cambiado; devuelve True si recargó.
+
+        Los cambios locales aún sin guardar se descartan.
+        """
+        if self.readonly:
+            return False
+        con = _connect()
+        try:
+            if self._read_version(con) == self._version:
+                return False
+            self._read(con)
+            return True
+        finally:
+            con.close()
+
+    def _write(self, con):
+        base = self._base or Persist()._state()
+        cur = self._state()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            for tabla, col, key in (("tipos", "tipo", "tipos"), ("nombres", "nombre", "nombres")):
+                new, old = cur[key], base[key]
+                con.executemany(
+                    f"INSERT INTO {tabla} (codigo, {col}) VALUES (?, ?) "
+                    f"ON CONFLICT(codigo) DO UPDATE SET {col}=excluded.{col}",
+                    [(k, v) for k, v in new.items() if old.get(k) != v])
+                con.executemany(f"DELETE FROM {tabla} WHERE codigo=?", [(k,) for k in old if k not in new])
+            for clase, key in (("proyecto", "excluir_proyectos"), ("recurso", "excluir_recursos")):
+                new, old = cur[key], base[key]
+                con.executemany("INSERT OR IGNORE INTO exclusiones (clase, clave) VALUES (?, ?)",
+                                [(clase, k) for k in new - old])
+                con.executemany("DELETE FROM exclusiones WHERE clase=? AND clave=?",
+                                [(clase, k) for k in old - new])
+            for k in ("asked_clasif", "asked_excl"):
+                if cur[k] != base[k]:
+                    con.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES (?, ?)", (k, "1" if cur[k] else "0"))
+            con.execute("INSERT INTO meta (clave, valor) VALUES ('version', '1') "
+                        "ON CONFLICT(clave) DO UPDATE SET valor=CAST(valor AS INTEGER) + 1")
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
 
     def save(self):
-        with open(JSON_PATH, "w", encoding="utf-8") as f:
-            json.dump({
-                "tipos": self.tipos,
-                "nombres": self.nombres,
-                "excluir_proyectos": self.excluir_proyectos,
-                "excluir_recursos": self.excluir_recursos,
-                "asked_clasif": self.asked_clasif,
-                "asked_excl": self.asked_excl,
-            }, f, ensure_ascii=False, indent=2)
+        """Guarda solo lo que ha cambiado y recarga lo que otros hayan guardado."""
+        if self.readonly:
+            return
+        con = _connect()
+        try:
+            self._write(con)
+            self._read(con)
+        finally:
+            con.close()
 
 # ======================================================================================
 # Lectura Excel
 # ======================================================================================
 
-def open_as_xlsx(path: str):
-    ext = os.path.splitext(path)[1].lower()
+class SheetReader(abc.ABC):
+    """Origen de datos de una hoja (la activa o la indicada con hoja=): filas de
+    valores crudos, sin estilos."""
+
+    @abc.abstractmethod
+    def iter_values(self):
+        """Tuplas de valores de cada fila de la hoja, en orden."""
+
+    @abc.abstractmethod
+    def hojas(self) -> List[str]:
+        """Nombres de las hojas de datos del libro, en su orden."""
+
+    def filas_estimadas(self) -> int:
+        """Filas de la hoja si el formato lo sabe sin leerla (0 si no)."""
+        return 0
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+XLSX_MAGIC = b"PK\x03\x04"          # zip (OOXML)
+XLS_MAGIC  = b"\xd0\xcf\x11\xe0"     # OLE2 (BIFF)
+
+def _is_path(source) -> bool:
+    return isinstance(source, (str, os.PathLike))
+
+def _as_bytes(source) -> bytes:
+    """bytes de un buffer o fichero abierto (sin copiar si ya son bytes)."""
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    return source.read()
+
+def source_ext(source, filename: Optional[str] = None) -> str:
+    """".xlsx" o ".xls" según la ruta, el nombre indicado o la firma del contenido."""
+    if _is_path(source):
+        return os.path.splitext(os.fspath(source))[1].lower()
+    if filename:
+        return os.path.splitext(filename)[1].lower()
+    head = bytes(source[:4]) if isinstance(source, (bytes, bytearray, memoryview)) else b""
+    return ".xlsx" if head == XLSX_MAGIC else (".xls" if head == XLS_MAGIC else "")
+
+class XlsxReader(SheetReader):
+    """Hoja de un .xlsx (ruta o fichero en memoria) abierto en modo read-only."""
+
+    def __init__(self, source, cleanup: bool = False, hoja: Optional[str] = None):
+        from openpyxl import load_workbook
+        self.path = source if _is_path(source) else None
+        self.cleanup = cleanup  # borrar el fichero al cerrar (temporales de conversión)
+        self.wb = load_workbook(source if self.path else io.BytesIO(_as_bytes(source)),
+                                read_only=True, data_only=True)
+        self.ws = self.wb[hoja] if hoja is not None else self.wb.active
+
+    def iter_values(self):
+        return self.ws.iter_rows(values_only=True)
+
+    def hojas(self) -> List[str]:
+        return [ws.title for ws in self.wb.worksheets]  # sin hojas de gráfico
+
+    def filas_estimadas(self) -> int:
+        return self.ws.max_row or 0
+
+    def close(self):
+        self.wb.close()
+        if self.cleanup and self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+class XlsReader(SheetReader):
+    """Hoja de un .xls (ruta o bytes) leída directamente con xlrd, sin pasar por .xlsx."""
+
+    def __init__(self, source, hoja: Optional[str] = None):
+        import xlrd
+        self._xlrd = xlrd
+        if _is_path(source):
+            self.book = xlrd.open_workbook(os.fspath(source), on_demand=True)
+        else:
+            self.book = xlrd.open_workbook(file_contents=_as_bytes(source), on_demand=True)
+        self.sheet = self.book.sheet_by_name(hoja) if hoja is not None else self._active_sheet()
+
+    def _active_sheet(self):
+        # xlrd no procesa WINDOW1; la hoja activa se marca en su WINDOW2 (sheet_visible).
+        for i in range(self.book.nsheets):
+            sh = self.book.sheet_by_index(i)
+            if sh.sheet_visible:
+                return sh
+            if i:
+                self.book.unload_sheet(i)
+        return self.book.sheet_by_index(0)
+
+    def _value(self, ctype, v):
+        xlrd = self._xlrd
+        if ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+            return None
+        if ctype == xlrd.XL_CELL_NUMBER:
+            return int(v) if v.is_integer() else v
+        if ctype == xlrd.XL_CELL_BOOLEAN:
+            return bool(v)
+        if ctype == xlrd.XL_CELL_DATE:
+            try:
+                dt = xlrd.xldate_as_datetime(v, self.book.datemode)
+            except (ValueError, OverflowError):
+                return v
+            base = (1904, 1, 1) if self.book.datemode else (1899, 12, 31)
+            return dt.time() if dt.timetuple()[:3] == base else dt
+        return v
+
+    def hojas(self) -> List[str]:
+        return self.book.sheet_names()
+
+    def filas_estimadas(self) -> int:
+        return self.sheet.nrows
+
+    def iter_values(self):
+        sh = self.sheet
+        for r in range(sh.nrows):
+            yield tuple(self._value(t, v) for t, v in zip(sh.row_types(r), sh.row_values(r)))
+
+    def close(self):
+        self.book.release_resources()
+
+def _xls_via_excel(source, hoja: Optional[str] = None) -> XlsxReader:
+    # Excel necesita rutas: único caso en el que se usan ficheros temporales.
+    import win32com.client as win32
+    tmp_in = None
+    if not _is_path(source):
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".xls") as f:
+            f.write(_as_bytes(source)); tmp_in = f.name
+    try:
+        excel = win32.Dispatch("Excel.Application"); excel.Visible = False
+        wb = excel.Workbooks.Open(os.path.abspath(tmp_in or os.fspath(source)))
+        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx"); tmp_path = tmp.name; tmp.close()
+        try:
+            wb.SaveAs(tmp_path, FileFormat=51)
+        finally:
+            wb.Close(False); excel.Quit()
+    finally:
+        if tmp_in:
+            os.remove(tmp_in)
+    return XlsxReader(tmp_path, cleanup=True, hoja=hoja)
+
+def open_reader(source, filename: Optional[str] = None, hoja: Optional[str] = None) -> SheetReader:
+    """Lector de la hoja activa (o de la hoja llamada hoja). source: ruta, bytes o
+    fichero abierto (filename da la extensión)."""
+    if not _is_path(source) and hasattr(source, "read"):
+        source = _as_bytes(source)  # antes de source_ext, que solo reconoce la firma en bytes
+    ext = source_ext(source, filename)
     if ext == ".xlsx":
-        return path, load_workbook(path, data_only=True)
+        return XlsxReader(source, hoja=hoja)
     if ext == ".xls":
         try:
-            import pandas as pd
-            xls = pd.ExcelFile(path, engine="xlrd")
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx"); tmp_path = tmp.name; tmp.close()
-            with pd.ExcelWriter(tmp_path, engine="openpyxl") as writer:
-                for sh in xls.sheet_names:
-                    df = pd.read_excel(xls, sheet_name=sh, header=None, dtype=str, engine="xlrd")
-                    df.to_excel(writer, sheet_name=sh, index=False, header=False)
-            return tmp_path, load_workbook(tmp_path, data_only=True)
+            return XlsReader(source, hoja)
         except Exception as e:
             try:
-                import win32com.client as win32
-                excel = win32.Dispatch("Excel.Application"); excel.Visible = False
-                wb = excel.Workbooks.Open(os.path.abspath(path))
-                tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx"); tmp_path = tmp.name; tmp.close()
-                wb.SaveAs(tmp_path, FileFormat=51); wb.Close(False); excel.Quit()
-                return tmp_path, load_workbook(tmp_path, data_only=True)
+                return _xls_via_excel(source, hoja)
             except Exception:
-                raise RuntimeError("Para .xls: usa pandas+xlrd>=2.0.1 o Excel (pywin32).") from e
+                raise RuntimeError("Para .xls: usa xlrd>=2.0.1 o Excel (pywin32).") from e
     raise ValueError("Extensión no soportada")
 
-def find_all_proyectos_positions(ws) -> List[int]:
+def open_grid(source, filename: Optional[str] = None, hoja: Optional[str] = None) -> SheetGrid:
+    """Carga la hoja activa (o hoja) en memoria con una sola pasada de solo valores."""
+    with open_reader(source, filename, hoja) as rd:
+        return load_grid(rd)
+
+def nombres_hojas(source, filename: Optional[str] = None) -> List[str]:
+    """Nombres de las hojas de datos de un libro (ruta, bytes o fichero abierto)."""
+    with open_reader(source, filename) as rd:
+        return rd.hojas()
+
+def find_all_proyectos_positions(ws, idx: Optional[RowIndex]=None) -> List[int]:
+    if idx is not None:
+        return list(idx.tags)
     res = []
-    for r in range(1, ws.max_row+1):
-        for c in range(1, ws.max_column+1):
-            if RE_PROYECTOS_TAG.match(read_cell(ws, r, c) or ""):
+    for r, row in enumerate(ws.rows, start=1):
+        for v in row:
+            if v and RE_PROYECTOS_TAG.match(v):
                 res.append(r); break
     return res
 
 def detect_day_grid(ws) -> Tuple[int, int]:
+    return _buscar_rejilla_dias(ws) or (31, 4)
+
+def _buscar_rejilla_dias(ws) -> Optional[Tuple[int, int]]:
+    """(n_days, day_start) de la fila 1..28+ de las cabeceras, o None si no hay."""
     for r in range(1, min(80, ws.max_row)+1):
         c = 1
         while c <= ws.max_column:
@@ -218,11 +695,20 @@ def detect_day_grid(ws) -> Tuple[int, int]:
                 c = k
             else:
                 c += 1
-    return 31, 4
+    return None
+
+def es_parte(ws) -> bool:
+    """La hoja tiene el formato de un parte: rejilla de días y alguna etiqueta "Proyectos:"."""
+    if _buscar_rejilla_dias(ws) is None:
+        return False
+    return any(v and RE_PROYECTOS_TAG.match(v) for row in ws.rows for v in row)
 
 def extract_recurso_line(ws, proyectos_row: int,
-                         n_days: Optional[int]=None, day_start: Optional[int]=None) -> str:
+                         n_days: Optional[int]=None, day_start: Optional[int]=None,
+                         idx: Optional[RowIndex]=None) -> str:
     """Busca hacia arriba hasta hallar un recurso válido, ignorando cabeceras."""
+    if idx is not None and proyectos_row in idx.recurso_de_tag:
+        return idx.recurso_de_tag[proyectos_row]
     if n_days is None or day_start is None:
         try:
             n_days2, day_start2 = detect_day_grid(ws)
@@ -231,17 +717,13 @@ def extract_recurso_line(ws, proyectos_row: int,
     else:
         n_days2, day_start2 = n_days, day_start
 
-    r = proyectos_row - 1
-    while r >= 1:
-        if _row_has_month_banner(ws, r) or _row_is_header_recurso(ws, r) or _row_is_header_dow(ws, r, day_start2, n_days2):
-            r -= 1
+    for r in range(proyectos_row - 1, 0, -1):
+        row = ws.row(r)
+        if _rasgos_fila(row, day_start2, n_days2)[0] & F_GARBAGE:
             continue
-
-        parts = [read_cell(ws, r, c) for c in range(1, 7)]
-        s = re.sub(r"\s+", " ", " ".join([p for p in parts if p])).strip()
-        if RE_RECURSO.match(s):
-            return s
-        r -= 1
+        recurso = _linea_recurso(row)
+        if recurso:
+            return recurso
     return "RECURSO DESCONOCIDO"
 
 # ======================================================================================
@@ -257,164 +739,674 @@ class RowData:
     tipo_imputacion: Optional[str] = None
     horas_por_dia: List[str] = field(default_factory=list)
 
-def parse_block(ws, r1, r2, recurso, n_days, day_start) -> List[RowData]:
-    rows = []
-    proyecto_actual = None
-    seq_max = 0
-    descartar_hasta_proyecto = False
-
-    def first_tipo_in_cols(r, cols=(1, 2, 3)):
-        for c in cols:
-            t = read_cell(ws, r, c)
-            if RE_TIPO_HORA.match(t or ""):
-                return t.strip(), c
-        return None, None
-
-    for r in range(r1, r2+1):
-        if is_garbage_row(ws, r, day_start, n_days):
-            continue
-
-        proj = None; proj_col = None
-        for c in (1, 2):
-            t = read_cell(ws, r, c)
-            p = normalize_project(t)
-            if p:
-                proj, proj_col = p, c
-                break
+@dataclass(frozen=True)
+class Exclusiones:
+    """Exclusiones compiladas a conjuntos para aplicarlas durante el parseo."""
+    recursos: frozenset = frozenset()
+    proyectos: frozenset = frozenset()
 
+    @classmethod
+    def de(cls, persist: 'Persist') -> "Exclusiones":
+        return cls(frozenset(persist.excluir_recursos), frozenset(persist.excluir_proyectos))
+
+    def __bool__(self):
+        return bool(self.recursos or self.proyectos)
+
+    def recurso(self, recurso: str) -> bool:
+        return recurso in self.recursos
+
+    def proyecto(self, codigo: Optional[str]) -> bool:
+        return codigo is not None and codigo in self.proyectos
+
+SIN_EXCLUSIONES = Exclusiones()
+
+class _BlockParser:
+    """Estado de parse_block fila a fila, para recorrer un bloque sin tenerlo entero.
+
+    feed() recibe cada fila con sus rasgos (ver _rasgos_fila) y devuelve la
+    RowData que produce, si alguna. Con activo=False no produce nada (bloques de
+    recursos excluidos que solo se recorren para descubrir proyectos). Las filas
+    que se habrían producido de no estar excluidas se cuentan en excluidas, sin
+    leer sus columnas de días.
+    """
+    __slots__ = ("recurso", "n_days", "day_start", "excl", "activo", "filas", "excluidas",
+                 "proyecto_actual", "proyecto_excluido", "seq_max", "descartar_hasta_proyecto")
+
+    def __init__(self, recurso: str, n_days: int, day_start: int,
+                 excl: Exclusiones = SIN_EXCLUSIONES, activo: bool = True):
+        self.recurso = recurso
+        self.n_days = n_days
+        self.day_start = day_start
+        self.excl = excl
+        self.activo = activo
+        self.filas = 0
+        self.excluidas = 0
+        self.proyecto_actual = None
+        self.proyecto_excluido = False
+        self.seq_max = 0
+        self.descartar_hasta_proyecto = False
+
+    def _row(self, row, tipo) -> RowData:
+        horas = list(row[self.day_start-1:self.day_start-1+self.n_days])
+        horas += [""] * (self.n_days - len(horas))
+        return RowData(
+            recurso=self.recurso,
+            proyecto_codigo=self.proyecto_actual[0],
+            proyecto_nombre=self.proyecto_actual[1],
+            tipo_imputacion=tipo,
+            horas_por_dia=horas
+        )
+
+    def feed(self, row, garbage, proj, tipos) -> Optional[RowData]:
+        if garbage:
+            return None
+        tipo = self._tipo(proj, tipos)
+        if tipo is None:
+            return None
+        if not self.activo or self.proyecto_excluido:
+            self.excluidas += 1
+            return None
+        return self._row(row, tipo)
+
+    def _tipo(self, proj, tipos) -> Optional[str]:
+        """Avanza el estado con una fila; devuelve su tipo si es una imputación."""
         if proj:
-            proyecto_actual = proj
-            seq_max = 0
-            descartar_hasta_proyecto = False
+            proj_col = proj[2]
+            self.proyecto_actual = proj[:2]
+            self.proyecto_excluido = self.excl.proyecto(self.proyecto_actual[0])
+            self.seq_max = 0
+            self.descartar_hasta_proyecto = False
             cols_inline = tuple(x for x in (proj_col+1, proj_col+2, 3) if 1 <= x <= max(3, proj_col+2))
-            tipo, _ = first_tipo_in_cols(r, cols_inline)
+            tipo = _first_tipo(tipos, cols_inline)
             if tipo:
-                m = re.match(r"^\s*(\d+)\s*-\s*", tipo); idx = int(m.group(1)) if m else 0
-                seq_max = idx
-                horas = [read_cell(ws, r, c) for c in range(day_start, day_start+n_days)]
-                rows.append(RowData(
-                    recurso=recurso,
-                    proyecto_codigo=proyecto_actual[0],
-                    proyecto_nombre=proyecto_actual[1],
-                    tipo_imputacion=tipo,
-                    horas_por_dia=horas
-                ))
-            continue
+                self.seq_max = tipo_index(tipo)
+            return tipo
 
-        if not proyecto_actual or descartar_hasta_proyecto:
-            continue
+        if not self.proyecto_actual or self.descartar_hasta_proyecto:
+            return None
 
-        tipo, _ = first_tipo_in_cols(r)
+        tipo = _first_tipo(tipos)
         if tipo:
-            m = re.match(r"^\s*(\d+)\s*-\s*", tipo); idx = int(m.group(1)) if m else 0
-            if idx <= seq_max:
-                descartar_hasta_proyecto = True
-                continue
-            seq_max = idx
-            horas = [read_cell(ws, r, c) for c in range(day_start, day_start+n_days)]
-            rows.append(RowData(
-                recurso=recurso,
-                proyecto_codigo=proyecto_actual[0],
-                proyecto_nombre=proyecto_actual[1],
-                tipo_imputacion=tipo,
-                horas_por_dia=horas
-            ))
-    return rows
+            idx_tipo = tipo_index(tipo)
+            if idx_tipo <= self.seq_max:
+                self.descartar_hasta_proyecto = True
+                return None
+            self.seq_max = idx_tipo
+        return tipo
+
+def parse_block(ws, r1, r2, recurso, n_days, day_start,
+                idx: Optional[RowIndex]=None, excl: Exclusiones = SIN_EXCLUSIONES) -> List[RowData]:
+    if idx is None:
+        idx = build_row_index(ws, n_days, day_start)
+    return _parse_block(ws, r1, r2, recurso, idx, excl)[0]
+
+def _parse_block(ws, r1, r2, recurso, idx: RowIndex, excl: Exclusiones,
+                 activo: bool = True) -> Tuple[List[RowData], int]:
+    """(filas, filas excluidas) de un bloque."""
+    bp = _BlockParser(recurso, idx.n_days, idx.day_start, excl, activo)
+    rows = []
+    for r in range(r1, r2+1):
+        rd = bp.feed(ws.row(r), idx.is_garbage(r), idx.proyecto.get(r), idx.tipos.get(r))
+        if rd is not None:
+            rows.append(rd)
+    return rows, bp.excluidas
+
+# ======================================================================================
+# Matriz de minutos
+# ======================================================================================
+
+class TablaHoras:
+    """Filas parseadas junto a su matriz de minutos (filas × días, int32).
+
+    Los totales se obtienen como reducciones sobre la matriz; cada texto "HH:MM"
+    distinto se convierte una sola vez (caché de classify_cell). Los totales por
+    fila y la parte fija de cada fila del IPI (todo salvo TIPO PROYECTO) se
+    calculan una vez y se conservan, también en las tablas filtradas, para que
+    reclasificar o cambiar exclusiones solo reaplique tipos, colores y sumas.
+    """
+    __slots__ = ("rows", "minutos", "n_days", "_totales", "_fijas")
+
+    def __init__(self, rows: List[RowData], minutos: "np.ndarray", n_days: int,
+                 totales: Optional["np.ndarray"] = None, fijas: Optional[List[list]] = None):
+        self.rows = rows
+        self.minutos = minutos
+        self.n_days = n_days
+        self._totales = totales
+        self._fijas = fijas
+
+    @classmethod
+    def from_rows(cls, rows: List[RowData], n_days: int) -> "TablaHoras":
+        flat = np.zeros((len(rows), n_days), dtype=np.int32)
+        for i, rd in enumerate(rows):
+            vals = rd.horas_por_dia[:n_days]
+            if vals:
+                flat[i, :len(vals)] = [hhmm_to_minutes(v) for v in vals]
+        return cls(rows, flat, n_days)
+
+    @classmethod
+    def unir(cls, tablas: List["TablaHoras"]) -> "TablaHoras":
+        """Concatena tablas (p. ej. de varias hojas); las de menos días se rellenan con ceros."""
+        n_days = max((t.n_days for t in tablas), default=31)
+        minutos = np.zeros((sum(len(t) for t in tablas), n_days), dtype=np.int32)
+        rows: List[RowData] = []
+        for t in tablas:
+            minutos[len(rows):len(rows) + len(t), :t.n_days] = t.minutos
+            rows.extend(t.rows)
+        return cls(rows, minutos, n_days)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def filtrar(self, mask: "np.ndarray") -> "TablaHoras":
+        # Se calculan en la tabla completa (que es la que se cachea) y se heredan.
+        fijas = self.filas_fijas()
+        sel = np.flatnonzero(mask)
+        return TablaHoras([self.rows[i] for i in sel], self.minutos[sel], self.n_days,
+                          self._totales[sel], [fijas[i] for i in sel])
+
+    def totales_fila(self) -> "np.ndarray":
+        if self._totales is None:
+            self._totales = self.minutos.sum(axis=1, dtype=np.int64)
+        return self._totales
+
+    def filas_fijas(self) -> List[list]:
+        """Valores de cada fila del IPI desde RECURSO hasta TOTAL DEC."""
+        if self._fijas is None:
+            n_days = self.n_days
+            fijas = []
+            for rd, total_min in zip(self.rows, self.totales_fila().tolist()):
+                fijas.append(fila_fija(rd, total_min, n_days))
+            self._fijas = fijas
+        return self._fijas
+
+def fila_fija(rd: RowData, total_min: int, n_days: int) -> list:
+    """Valores de una fila del IPI desde RECURSO hasta TOTAL DEC."""
+    vals = rd.horas_por_dia[:n_days]
+    values = [rd.recurso, f"{rd.proyecto_codigo} - {rd.proyecto_nombre}", rd.tipo_imputacion or None]
+    values += [v or None for v in vals]
+    values += [None] * (n_days - len(vals))
+    values += [minutes_to_hhmm(total_min), round(total_min/60.0, 2)]
+    return values
+
+# ======================================================================================
+# Cubo de agregación
+# ======================================================================================
+
+class CuboHoras:
+    """Minutos por recurso × proyecto × tipo de imputación × día.
+
+    Se construye en una sola pasada sobre una TablaHoras: cada fila aporta su
+    vector de días a la celda (recurso, proyecto, tipo). Solo se guardan las
+    combinaciones presentes (coordenadas r/p/t + matriz celdas × días), y todos
+    los totales del IPI y de los resúmenes son reducciones sobre ese cubo.
+    """
+    __slots__ = ("recursos", "proyectos", "tipos", "r", "p", "t", "minutos")
+
+    def __init__(self, recursos: List[str], proyectos: List[Tuple[Optional[str], str]], tipos: List[str],
+                 r: "np.ndarray", p: "np.ndarray", t: "np.ndarray", minutos: "np.ndarray"):
+        self.recursos = recursos
+        self.proyectos = proyectos
+        self.tipos = tipos
+        self.r, self.p, self.t = r, p, t
+        self.minutos = minutos
+
+    @classmethod
+    def from_tabla(cls, tabla: TablaHoras) -> "CuboHoras":
+        rec: Dict[str, int] = {}; proy: Dict[Tuple, int] = {}; tip: Dict[str, int] = {}
+        codigos = np.empty((len(tabla), 3), dtype=np.int64)
+        for i, rd in enumerate(tabla.rows):
+            codigos[i, 0] = rec.setdefault(rd.recurso, len(rec))
+            codigos[i, 1] = proy.setdefault((rd.proyecto_codigo, rd.proyecto_nombre), len(proy))
+            codigos[i, 2] = tip.setdefault(rd.tipo_imputacion or "", len(tip))
+        celdas, inv = np.unique(codigos, axis=0, return_inverse=True)
+        minutos = np.zeros((len(celdas), tabla.n_days), dtype=np.int64)
+        np.add.at(minutos, inv.ravel(), tabla.minutos)
+        return cls(list(rec), list(proy), list(tip), celdas[:, 0], celdas[:, 1], celdas[:, 2], minutos)
+
+    @classmethod
+    def from_celdas(cls, celdas: Dict[Tuple[str, Tuple[Optional[str], str], str], "np.ndarray"],
+                    n_days: int) -> "CuboHoras":
+        """Cubo a partir de {(recurso, (código, nombre), tipo): minutos por día}, ver AcumuladorCubo."""
+        rec: Dict[str, int] = {}; proy: Dict[Tuple, int] = {}; tip: Dict[str, int] = {}
+        coords = [(rec.setdefault(r, len(rec)), proy.setdefault(p, len(proy)), tip.setdefault(t, len(tip)))
+                  for r, p, t in celdas]
+        c = np.array(coords, dtype=np.int64).reshape(-1, 3)
+        minutos = np.array(list(celdas.values()), dtype=np.int64).reshape(-1, n_days)
+        return cls(list(rec), list(proy), list(tip), c[:, 0], c[:, 1], c[:, 2], minutos)
+
+    def total(self) -> int:
+        return int(self.minutos.sum())
+
+    def _reducir(self, codigos: "np.ndarray", n: int, mask: Optional["np.ndarray"] = None) -> "np.ndarray":
+        tot = self.minutos.sum(axis=1)
+        if mask is not None:
+            codigos, tot = codigos[mask], tot[mask]
+        return np.bincount(codigos, weights=tot, minlength=n).astype(np.int64)
+
+    def por_recurso(self) -> Dict[str, int]:
+        return {k: int(v) for k, v in zip(self.recursos, self._reducir(self.r, len(self.recursos))) if k}
+
+    def por_proyecto(self) -> Dict[Tuple[Optional[str], str], int]:
+        return {k: int(v) for k, v in zip(self.proyectos, self._reducir(self.p, len(self.proyectos)))}
+
+    def por_tipo_imputacion(self) -> Dict[str, int]:
+        return {k: int(v) for k, v in zip(self.tipos, self._reducir(self.t, len(self.tipos))) if k}
+
+    def por_dia(self) -> "np.ndarray":
+        return self.minutos.sum(axis=0)
+
+    def _tipo_proyecto(self, persist: 'Persist') -> Tuple[List[str], "np.ndarray", "np.ndarray"]:
+        """Clases de proyecto, código de clase de cada celda y máscara de celdas
+        computables (con tipo de imputación), como en los totales del IPI."""
+        clases: Dict[str, int] = {}
+        por_proy = np.array([clases.setdefault(persist.tipos.get(cod, ""), len(clases))
+                             for cod, _ in self.proyectos], dtype=np.int64)
+        con_tipo = np.array([bool(t) for t in self.tipos], dtype=bool)
+        return list(clases), por_proy[self.p], con_tipo[self.t]
+
+    def por_tipo_proyecto(self, persist: 'Persist') -> Dict[str, int]:
+        clases, cod, mask = self._tipo_proyecto(persist)
+        return {k: int(v) for k, v in zip(clases, self._reducir(cod, len(clases), mask)) if k}
+
+    def tipo_proyecto_por_recurso(self, persist: 'Persist') -> Dict[str, Dict[str, int]]:
+        clases, cod, mask = self._tipo_proyecto(persist)
+        n = len(clases)
+        tabla = self._reducir(self.r * n + cod, len(self.recursos) * n, mask).reshape(len(self.recursos), n)
+        return {rec: {k: int(v) for k, v in zip(clases, fila) if k}
+                for rec, fila in zip(self.recursos, tabla.tolist()) if rec}
+
+class AcumuladorCubo:
+    """Cubo construido fila a fila: solo guarda un vector de días por combinación
+    (recurso, proyecto, tipo), no las filas."""
+
+    def __init__(self, n_days: int):
+        self.n_days = n_days
+        self.celdas: Dict[Tuple, "np.ndarray"] = {}
+
+    def add(self, rd: RowData, minutos: List[int]):
+        key = (rd.recurso, (rd.proyecto_codigo, rd.proyecto_nombre), rd.tipo_imputacion or "")
+        acc = self.celdas.get(key)
+        if acc is None:
+            acc = self.celdas[key] = np.zeros(self.n_days, dtype=np.int64)
+        acc[:len(minutos)] += minutos
+
+    def cubo(self) -> CuboHoras:
+        return CuboHoras.from_celdas(self.celdas, self.n_days)
 
 # ======================================================================================
 # Salida IPI
 # ======================================================================================
 
-def style_header(ws, row_idx, n_days):
-    fill = PatternFill("solid", fgColor=COLOR_HEADER)
-    bold = Font(bold=True)
-    align = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    border = Border(left=Side(style="thin"), right=Side(style="thin"),
-                    top=Side(style="thin"), bottom=Side(style="thin"))
-    headers = ["RECURSO", "PROYECTO", "TIPO IMPUTACIÓN"] + [str(i) for i in range(1, n_days+1)] + ["TOTAL", "TOTAL DEC", "TIPO PROYECTO"]
-    for c, t in enumerate(headers, 1):
-        cell = ws.cell(row=row_idx, column=c, value=t)
-        cell.fill = fill; cell.font = bold; cell.alignment = align; cell.border = border
-    ws.column_dimensions["A"].width = 36
-    ws.column_dimensions["B"].width = 48
-    ws.column_dimensions["C"].width = 22
-
-def style_row(ws, row_idx, color, n_cols):
-    if not color:
-        return
-    fill = PatternFill("solid", fgColor=color)
-    border = Border(left=Side(style="thin"), right=Side(style="thin"),
-                    top=Side(style="thin"), bottom=Side("thin"))
-    for c in range(1, n_cols+1):
-        cell = ws.cell(row=row_idx, column=c)
-        cell.fill = fill; cell.border = border
-
-def build_output(wb_out, rows: List['RowData'], persist: 'Persist', n_days: int):
-    if SHEET_SALIDA in wb_out.sheetnames:
-        del wb_out[SHEET_SALIDA]
-    ws = wb_out.create_sheet(SHEET_SALIDA)
-    style_header(ws, 1, n_days)
-    r0 = 2
-    for rd in rows:
-        rd.tipo_proyecto = persist.tipos.get(rd.proyecto_codigo, "")
-        ws.cell(row=r0, column=1, value=rd.recurso)
-        ws.cell(row=r0, column=2, value=f"{rd.proyecto_codigo} - {rd.proyecto_nombre}")
-        ws.cell(row=r0, column=3, value=rd.tipo_imputacion or "")
-
-        vals = rd.horas_por_dia[:n_days]
-        for i, v in enumerate(vals, start=4):
-            ws.cell(row=r0, column=i, value=v or "")
-        col_total = 3 + n_days + 1
-        col_total_dec = 3 + n_days + 2
-        col_tipo = 3 + n_days + 3
-
-        total_min = sum(hhmm_to_minutes(v) for v in vals)
-        ws.cell(row=r0, column=col_total, value=minutes_to_hhmm(total_min))
-        ws.cell(row=r0, column=col_total_dec, value=round(total_min/60.0, 2))
-        ws.cell(row=r0, column=col_tipo, value=rd.tipo_proyecto or "")
-
-        color = COLOR_CONSTRUCCION if rd.tipo_proyecto == "CONSTRUCCION" else (COLOR_REPARACION if rd.tipo_proyecto == "REPARACION" else None)
-        style_row(ws, r0, color, col_tipo)
-        r0 += 1
+STYLE_HEADER       = "ipi_cabecera"
+STYLE_SECCION      = "ipi_seccion"
+STYLE_CONSTRUCCION = "ipi_construccion"
+STYLE_REPARACION   = "ipi_reparacion"
+STYLE_POR_TIPO     = {"CONSTRUCCION": STYLE_CONSTRUCCION, "REPARACION": STYLE_REPARACION}
+
+def libro_salida():
+    """Workbook(write_only=True) para el IPI y los resúmenes."""
+    from openpyxl import Workbook
+    return Workbook(write_only=True)
+
+def register_styles(wb):
+    """Registra una sola vez los estilos con nombre que usan las filas del IPI."""
+    from openpyxl.styles import PatternFill, Alignment, Border, Side, Font, NamedStyle
+    thin = Side(style="thin")
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    font = Font(name="Calibri", sz=11, family=2, scheme="minor")
+    styles = [
+        NamedStyle(STYLE_HEADER, font=Font(name="Calibri", sz=11, family=2, scheme="minor", b=True), border=border,
+                   fill=PatternFill("solid", fgColor=COLOR_HEADER),
+                   alignment=Alignment(horizontal="center", vertical="center", wrap_text=True)),
+        NamedStyle(STYLE_SECCION, font=font, border=border,
+                   fill=PatternFill("solid", fgColor=COLOR_HEADER)),
+        NamedStyle(STYLE_CONSTRUCCION, font=font, border=border,
+                   fill=PatternFill("solid", fgColor=COLOR_CONSTRUCCION)),
+        NamedStyle(STYLE_REPARACION, font=font, border=border,
+                   fill=PatternFill("solid", fgColor=COLOR_REPARACION)),
+    ]
+    for st in styles:
+        if st.name not in wb.named_styles:
+            wb.add_named_style(st)
+
+def _styled_row(ws, values, style, n_cols):
+    """Fila de n_cols celdas write-only con el mismo estilo (rellena con vacías)."""
+    from openpyxl.cell import WriteOnlyCell
+    out = []
+    for c in range(n_cols):
+        cell = WriteOnlyCell(ws, value=values[c] if c < len(values) else None)
+        cell.style = style
+        out.append(cell)
+    return out
 
+def build_output(wb_out, rows, persist: 'Persist', n_days: int, sheet_name: str = SHEET_SALIDA,
+                 informe: Optional['Informe'] = None, cubo: Optional[CuboHoras] = None,
+                 origen: Optional[List[str]] = None) -> int:
+    """Escribe la hoja IPI en un Workbook(write_only=True) fila a fila.
+
+    rows puede ser una TablaHoras o una lista de RowData; los bloques de totales
+    salen de cubo (se construye si no se pasa). Con origen (una hoja de origen por
+    fila) se añade delante la columna HOJA. Devuelve las celdas escritas.
+    """
+    informe = informe or SIN_INFORME
+    tabla = rows if isinstance(rows, TablaHoras) else TablaHoras.from_rows(list(rows), n_days)
+    if cubo is None:
+        cubo = CuboHoras.from_tabla(tabla)
+    ws, n_cols = _ipi_hoja(wb_out, n_days, sheet_name, con_origen=origen is not None)
+    celdas = n_cols * (len(tabla) + 1)
+
+    # Solo TIPO PROYECTO y el color dependen de la clasificación; el resto de la
+    # fila y sus totales vienen precalculados en la tabla.
+    tipos = [persist.tipos.get(rd.proyecto_codigo, "") for rd in tabla.rows]
+    fijas = tabla.filas_fijas()
+    if origen is not None:
+        fijas = ([hoja] + fija for hoja, fija in zip(origen, fijas))
+
+    for i, (fija, tipo) in enumerate(zip(fijas, tipos)):
+        if i % 500 == 0:
+            informe.avance("filas", i, len(tabla))
+        _ipi_fila(ws, fija, tipo, n_cols)
+
+    informe.avance("filas", len(tabla), len(tabla))
+    return celdas + _ipi_totales(ws, cubo, persist, n_cols)
+
+def _ipi_hoja(wb_out, n_days: int, sheet_name: str = SHEET_SALIDA, con_origen: bool = False):
+    """Crea la hoja IPI con su cabecera; devuelve (hoja, columnas)."""
+    register_styles(wb_out)
+    ws = wb_out.create_sheet(sheet_name)
+    anchos = ([24] if con_origen else []) + [36, 48, 22]
+    for col, w in zip("ABCD", anchos):
+        ws.column_dimensions[col].width = w
+
+    headers = ["RECURSO", "PROYECTO", "TIPO IMPUTACIÓN"] + [str(i) for i in range(1, n_days+1)] + ["TOTAL", "TOTAL DEC", "TIPO PROYECTO"]
+    if con_origen:
+        headers.insert(0, "HOJA")
+    n_cols = len(headers)
+    ws.append(_styled_row(ws, headers, STYLE_HEADER, n_cols))
+    return ws, n_cols
+
+def _ipi_fila(ws, fija: list, tipo: str, n_cols: int):
+    values = fija + [tipo or None]
+    style = STYLE_POR_TIPO.get(tipo)
+    ws.append(_styled_row(ws, values, style, n_cols) if style else values)
+
+def _ipi_totales(ws, cubo: CuboHoras, persist: 'Persist', n_cols: int) -> int:
+    """Bloques de totales al pie del IPI; devuelve las celdas escritas."""
     # Totales por tipo de imputación
-    sumas: Dict[str, int] = {}
-    for rd in rows:
-        if not rd.tipo_imputacion:
-            continue
-        total_min = sum(hhmm_to_minutes(x) for x in rd.horas_por_dia[:n_days])
-        sumas[rd.tipo_imputacion] = sumas.get(rd.tipo_imputacion, 0) + total_min
-    ws.cell(row=r0+1, column=1, value="TOTALES POR TIPO DE IMPUTACIÓN")
-    style_row(ws, r0+1, COLOR_HEADER, 3 + n_days + 3)
-    rr = r0 + 2
+    sumas = cubo.por_tipo_imputacion()
+    ws.append([])
+    ws.append(_styled_row(ws, ["TOTALES POR TIPO DE IMPUTACIÓN"], STYLE_SECCION, n_cols))
     for k, v in sorted(sumas.items()):
-        ws.cell(row=rr, column=1, value=k)
-        ws.cell(row=rr, column=2, value=minutes_to_hhmm(v))
-        ws.cell(row=rr, column=3, value=round(v/60.0, 2))
-        rr += 1
+        ws.append([k, minutes_to_hhmm(v), round(v/60.0, 2)])
+    celdas = n_cols + 3 * len(sumas)
 
     # Totales por tipo de proyecto + TOTAL*27
-    sum_tipo = {"CONSTRUCCION": 0, "REPARACION": 0}
-    for rd in rows:
-        if not rd.tipo_imputacion or rd.tipo_proyecto not in sum_tipo:
-            continue
-        sum_tipo[rd.tipo_proyecto] += sum(hhmm_to_minutes(x) for x in rd.horas_por_dia[:n_days])
-
-    ws.cell(row=rr + 1, column=1, value="TOTALES POR TIPO DE PROYECTO")
-    style_row(ws, rr + 1, COLOR_HEADER, 3 + n_days + 4)
-    ws.cell(row=rr + 1, column=4, value="TOTAL*27")
-
-    rtp = rr + 2
+    por_tipo = cubo.por_tipo_proyecto(persist)
+    ws.append([])
+    ws.append(_styled_row(ws, ["TOTALES POR TIPO DE PROYECTO", None, None, "TOTAL*27"], STYLE_SECCION, n_cols + 1))
     for key in ("CONSTRUCCION", "REPARACION"):
-        total_min = sum_tipo[key]
+        total_min = por_tipo.get(key, 0)
         total_dec = round(total_min / 60.0, 2)
         total_x27 = round(total_dec * 27.0, 2)
+        ws.append([key, minutes_to_hhmm(total_min), total_dec, total_x27])
+    return celdas + n_cols + 1 + 4 * 2
+
+SHEET_POR_RECURSO  = "HORAS POR RECURSO"
+SHEET_POR_PROYECTO = "HORAS POR PROYECTO"
+SHEET_POR_DIA      = "HORAS POR DIA"
+SHEET_TIPO_RECURSO = "CONS-REP POR RECURSO"
+
+def build_resumenes(wb_out, cubo: CuboHoras, persist: 'Persist') -> int:
+    """Hojas de resumen (por recurso, por proyecto, por día y CONSTRUCCION /
+    REPARACION por recurso) sacadas del cubo. Devuelve las celdas escritas."""
+    celdas = 0
+
+    def hoja(titulo, cabecera, filas, anchos):
+        nonlocal celdas
+        ws = wb_out.create_sheet(titulo)
+        for col, w in zip("ABCDEFG", anchos):
+            ws.column_dimensions[col].width = w
+        ws.append(_styled_row(ws, cabecera, STYLE_HEADER, len(cabecera)))
+        for fila in filas:
+            ws.append(fila)
+            celdas += len(fila)
+        celdas += len(cabecera)
+
+    def hm(m):
+        return [minutes_to_hhmm(m), round(m/60.0, 2)]
+
+    hoja(SHEET_POR_RECURSO, ["RECURSO", "TOTAL", "TOTAL DEC"],
+         ([k] + hm(v) for k, v in sorted(cubo.por_recurso().items())), [36, 10, 10])
+    hoja(SHEET_POR_PROYECTO, ["CÓDIGO", "PROYECTO", "TIPO PROYECTO", "TOTAL", "TOTAL DEC"],
+         ([cod, nom, persist.tipos.get(cod, "") or None] + hm(v)
+          for (cod, nom), v in sorted(cubo.por_proyecto().items(), key=lambda kv: (kv[0][0] or "", kv[0][1]))),
+         [10, 48, 16, 10, 10])
+    hoja(SHEET_POR_DIA, ["DÍA", "TOTAL", "TOTAL DEC"],
+         ([d] + hm(v) for d, v in enumerate(cubo.por_dia().tolist(), start=1)), [8, 10, 10])
+    claves = list(STYLE_POR_TIPO)
+    hoja(SHEET_TIPO_RECURSO, ["RECURSO"] + [f"{k} {s}" for k in claves for s in ("TOTAL", "DEC")],
+         ([rec] + [x for k in claves for x in hm(d.get(k, 0))]
+          for rec, d in sorted(cubo.tipo_proyecto_por_recurso(persist).items())),
+         [36] + [16] * (2 * len(claves)))
+    return celdas
+
+# ======================================================================================
+# Exportación tabular
+# ======================================================================================
+
+COLUMNAS_EXPORT = ("recurso", "proyecto_codigo", "proyecto_nombre", "tipo_imputacion",
+                   "tipo_proyecto", "day", "minutes")
+
+def iter_registros(tabla: TablaHoras, persist: 'Persist', chunk: int = 4096):
+    """Registros en formato largo (una tupla por fila y día con minutos), en el
+    orden del IPI. Recorre la matriz por tramos para no materializarlo todo."""
+    for a in range(0, len(tabla), chunk):
+        filas, dias = np.nonzero(tabla.minutos[a:a+chunk])
+        mins = tabla.minutos[a:a+chunk][filas, dias].tolist()
+        prev, base = -1, None
+        for f, d, m in zip(filas.tolist(), dias.tolist(), mins):
+            if f != prev:
+                rd = tabla.rows[a+f]
+                base = (rd.recurso, rd.proyecto_codigo, rd.proyecto_nombre, rd.tipo_imputacion or None,
+                        persist.tipos.get(rd.proyecto_codigo, "") or None)
+                prev = f
+            yield base + (d + 1, m)
+
+class Exportador(abc.ABC):
+    """Escritor de registros en formato largo sobre una ruta o un fichero binario."""
+    formato = ""
+    extension = ""
+    mime = "application/octet-stream"
+
+    def __init__(self, dest):
+        self._own = _is_path(dest)
+        self.f = open(dest, "wb") if self._own else dest
+
+    @abc.abstractmethod
+    def write(self, registros) -> int:
+        """Escribe los registros y devuelve cuántos ha escrito."""
+
+    def close(self):
+        if self._own:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class CsvExportador(Exportador):
+    formato, extension, mime = "csv", ".csv", "text/csv"
+
+    def write(self, registros) -> int:
+        out = io.TextIOWrapper(self.f, encoding="utf-8", newline="", write_through=True)
+        w = csv.writer(out)
+        w.writerow(COLUMNAS_EXPORT)
+        n = 0
+        for reg in registros:
+            w.writerow(reg); n += 1
+        out.flush(); out.detach()
+        return n
+
+class JsonlExportador(Exportador):
+    formato, extension, mime = "jsonl", ".jsonl", "application/x-ndjson"
+
+    def write(self, registros) -> int:
+        n = 0
+        for reg in registros:
+            self.f.write(json.dumps(dict(zip(COLUMNAS_EXPORT, reg)), ensure_ascii=False).encode("utf-8"))
+            self.f.write(b"\n"); n += 1
+        return n
+
+class ParquetExportador(Exportador):
+    formato, extension, mime = "parquet", ".parquet", "application/vnd.apache.parquet"
+    LOTE = 65536
+
+    def write(self, registros) -> int:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Para exportar a Parquet hace falta pyarrow (pip install pyarrow).") from e
+        schema = pa.schema([(c, pa.string()) for c in COLUMNAS_EXPORT[:5]]
+                           + [("day", pa.int8()), ("minutes", pa.int32())])
+        n = 0
+        with pq.ParquetWriter(self.f, schema) as pw:
+            lote = []
+            for reg in registros:
+                lote.append(reg)
+                if len(lote) == self.LOTE:
+                    pw.write_batch(pa.RecordBatch.from_pylist([dict(zip(COLUMNAS_EXPORT, r)) for r in lote], schema))
+                    n += len(lote); lote = []
+            if lote or not n:
+                pw.write_batch(pa.RecordBatch.from_pylist([dict(zip(COLUMNAS_EXPORT, r)) for r in lote], schema))
+                n += len(lote)
+        return n
+
+EXPORTADORES = {e.formato: e for e in (CsvExportador, JsonlExportador, ParquetExportador)}
+
+def formatos_salida() -> List[str]:
+    """Formatos admitidos por process_file: el IPI en xlsx y los de EXPORTADORES
+    (parquet solo si pyarrow está instalado)."""
+    fmts = ["xlsx", "csv", "jsonl"]
+    try:
+        import pyarrow.parquet  # noqa: F401
+        fmts.append("parquet")
+    except ImportError:
+        pass
+    return fmts
+
+# ======================================================================================
+# Instrumentación
+# ======================================================================================
+
+class _Etapa:
+    __slots__ = ("informe", "nombre", "t0")
+
+    def __init__(self, informe: "Informe", nombre: str):
+        self.informe = informe
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        et = self.informe.etapas
+        et[self.nombre] = et.get(self.nombre, 0.0) + time.perf_counter() - self.t0
+
+class _SinMedir:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_SIN_MEDIR = _SinMedir()
+
+class Informe:
+    """Tiempos por etapa (s) y contadores de una ejecución de process_file.
+
+    Con enabled=False los ganchos no miden nada: etapa() devuelve un contexto
+    compartido vacío y contar() retorna sin tocar diccionarios.
+    """
+
+    def __init__(self, enabled: bool = True, progreso: Optional["Progreso"] = None):
+        self.enabled = enabled
+        self.progreso = progreso
+        self.salida: Optional[str] = None          # ruta del IPI si se escribió a disco
+        self.nombre_salida: Optional[str] = None
+        self.buffer: Optional[io.BytesIO] = None   # IPI en memoria si la entrada no era una ruta
+        self.descubiertos: Optional[Tuple[List[str], Dict[str, str]]] = None  # (recursos, proyectos) en modo streaming
+        self.etapas: Dict[str, float] = {}
+        self.contadores: Dict[str, int] = {}
+
+    def etapa(self, nombre: str):
+        if self.progreso is not None:
+            self.progreso.update(nombre, 0, 0)
+        return _Etapa(self, nombre) if self.enabled else _SIN_MEDIR
+
+    def contar(self, nombre: str, n: int = 1):
+        if self.enabled:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + n
+
+    def avance(self, fase: str, hecho: int, total: int):
+        """Notifica progreso; lanza Cancelado si el trabajo se ha cancelado."""
+        if self.progreso is not None:
+            self.progreso.update(fase, hecho, total)
+
+    def merge(self, other: "Informe") -> "Informe":
+        for k, v in other.etapas.items():
+            self.etapas[k] = self.etapas.get(k, 0.0) + v
+        for k, v in other.contadores.items():
+            self.contadores[k] = self.contadores.get(k, 0) + v
+        return self
 
-        ws.cell(row=rtp, column=1, value=key)
-        ws.cell(row=rtp, column=2, value=minutes_to_hhmm(total_min))
-        ws.cell(row=rtp, column=3, value=total_dec)
-        ws.cell(row=rtp, column=4, value=total_x27)
-        rtp += 1
+    def to_dict(self) -> Dict:
+        return {
+            "salida": self.salida,
+            "etapas": {k: round(v, 4) for k, v in self.etapas.items()},
+            "total": round(sum(self.etapas.values()), 4),
+            "contadores": dict(self.contadores),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+SIN_INFORME = Informe(enabled=False)
+
+class Cancelado(Exception):
+    """El usuario canceló el trabajo en curso."""
+
+class Progreso:
+    """Avance de un trabajo, compartido entre el hilo que procesa y la interfaz."""
+
+    def __init__(self):
+        self.fase = "en cola"
+        self.hecho = 0
+        self.total = 0
+        self._cancel = threading.Event()
+
+    def update(self, fase: str, hecho: int, total: int):
+        self.fase, self.hecho, self.total = fase, hecho, total
+        if self._cancel.is_set():
+            raise Cancelado()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def fraccion(self) -> float:
+        return min(1.0, self.hecho / self.total) if self.total else 0.0
+
+    def texto(self) -> str:
+        return f"{self.fase}: {self.hecho}/{self.total}" if self.total else self.fase
 
 # ======================================================================================
 # Pipeline
@@ -432,13 +1424,94 @@ def collect_discovered(recursos: List[str], proyectos: Dict[str, str], persist:
     if changed:
         persist.save()
 
-def process_file(input_path: str, persist: 'Persist') -> str:
-    xlsx_path, wb = open_as_xlsx(input_path); ws = wb.active
-    pos = find_all_proyectos_positions(ws)
+# ======================================================================================
+# Parseo de bloques en paralelo
+# ======================================================================================
+
+BLOCK_JOBS = int(os.environ.get("BLOCK_JOBS", "1"))  # procesos por defecto para parse_grid
+MIN_BLOCKS_PARALLEL = 64  # por debajo no compensa arrancar el pool
+
+# Sin fork: los pools se abren también desde los hilos de JobManager dentro del servidor
+# de Streamlit, y un fork con otros hilos vivos puede heredar un lock tomado y colgarse.
+MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+_shared_sheet: Optional[Tuple[SheetGrid, RowIndex, Exclusiones]] = None
+
+def _init_block_worker(ws: SheetGrid, idx: RowIndex, excl: Exclusiones = SIN_EXCLUSIONES):
+    # La hoja se envía una vez por proceso, no una por tarea.
+    global _shared_sheet
+    _shared_sheet = (ws, idx, excl)
+
+def _parse_block_chunk(chunk: List[Tuple[int, int, str]]) -> List[Tuple[List[RowData], int]]:
+    ws, idx, excl = _shared_sheet
+    return [_parse_block(ws, r1, r2, recurso, idx, excl) for r1, r2, recurso in chunk]
+
+def parse_blocks_parallel(ws: SheetGrid, idx: RowIndex, tareas: List[Tuple[int, int, str]],
+                          jobs: int, informe: Optional["Informe"] = None,
+                          excl: Exclusiones = SIN_EXCLUSIONES) -> List[Tuple[List[RowData], int]]:
+    """(filas, filas excluidas) de cada (r1, r2, recurso), en un pool de procesos.
+
+    Los resultados vuelven en el orden de tareas, así que la salida es idéntica
+    a la del recorrido secuencial.
+    """
+    n_chunks = min(len(tareas), jobs * 4)
+    size = -(-len(tareas) // n_chunks)
+    chunks = [tareas[i:i+size] for i in range(0, len(tareas), size)]
+    out: List[Tuple[List[RowData], int]] = []
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=MP_CONTEXT,
+                             initializer=_init_block_worker, initargs=(ws, idx, excl)) as ex:
+        for res in ex.map(_parse_block_chunk, chunks):
+            out.extend(res)
+            if informe is not None:
+                informe.avance("bloques", len(out), len(tareas))
+    return out
+
+@dataclass
+class ParsedSheet:
+    """Resultado completo del parseo de una hoja, reutilizable entre pasos.
+
+    Es lo único que consumen el descubrimiento (web y Tk) y process_file, de modo
+    que descubrir y luego procesar un fichero lo parsea una sola vez.
+    """
+    n_days: int
+    day_start: int
+    bloques: List[Tuple[int, int]]
+    recursos: List[str]          # en orden de aparición
+    proyectos: Dict[str, str]    # código -> nombre, de todas las filas de proyecto de los bloques
+    tabla: TablaHoras
+    exclusiones: Exclusiones = SIN_EXCLUSIONES  # ya aplicadas en el parseo (recursos/proyectos siguen completos)
+
+    @property
+    def layout(self) -> Tuple[int, int]:
+        return self.n_days, self.day_start
+
+    @property
+    def rows(self) -> List[RowData]:
+        return self.tabla.rows
+
+    def discovered(self) -> Tuple[List[str], Dict[str, str]]:
+        """(recursos, proyectos) ordenados, para los editores de clasificación y exclusiones."""
+        return sorted(self.recursos), dict(sorted(self.proyectos.items()))
+
+def parse_grid(ws, informe: Informe = SIN_INFORME, jobs: Optional[int] = None,
+               excl: Exclusiones = SIN_EXCLUSIONES) -> ParsedSheet:
+    """Parsea la hoja completa. Con jobs > 1 los bloques se reparten entre procesos.
+
+    Con excl, los bloques de recursos excluidos y las filas de proyectos excluidos
+    no se llegan a leer; recursos y proyectos se descubren igualmente.
+    """
+    hits0, misses0 = token_cache_stats()
+    with informe.etapa("detect_day_grid"):
+        n_days, day_start = detect_day_grid(ws)
+    with informe.etapa("indice_filas"):
+        idx = build_row_index(ws, n_days, day_start)
+        pos = find_all_proyectos_positions(ws, idx)
     if not pos:
         raise RuntimeError("No se encontró 'Proyectos:'")
-
-    n_days, day_start = detect_day_grid(ws)
+    informe.contar("filas_escaneadas", ws.max_row)
+    if informe.enabled:
+        informe.contar("filas_basura", sum(1 for f in idx.flags if f & F_GARBAGE))
 
     bloques = []
     for i, r in enumerate(pos):
@@ -446,186 +1519,913 @@ def process_file(input_path: str, persist: 'Persist') -> str:
         r2 = pos[i+1]-2 if i < len(pos)-1 else ws.max_row
         if r1 <= r2:
             bloques.append((r1, r2))
+    informe.contar("bloques", len(bloques))
+
+    all_rows = []; recursos = []; proyectos = {}; tareas = []
+    with informe.etapa("parse_block"):
+        for (r1, r2) in bloques:
+            recurso = extract_recurso_line(ws, r1, n_days, day_start, idx) or "RECURSO DESCONOCIDO"
+            if recurso not in recursos:
+                recursos.append(recurso)
+            for r in range(r1, r2+1):
+                p = idx.proyecto.get(r)
+                if p and p[1]:
+                    proyectos[p[0]] = p[1]
+            if excl.recurso(recurso):
+                informe.contar("bloques_excluidos")
+                if informe.enabled:  # solo para contar sus filas; no se leen los días
+                    informe.contar("filas_excluidas", _parse_block(ws, r1, r2, recurso, idx, excl, activo=False)[1])
+                continue
+            tareas.append((r1, r2, recurso))
+        jobs = BLOCK_JOBS if jobs is None else jobs
+        if jobs > 1 and len(tareas) >= MIN_BLOCKS_PARALLEL:
+            for rows, excluidas in parse_blocks_parallel(ws, idx, tareas, jobs, informe, excl):
+                all_rows.extend(rows)
+                informe.contar("filas_excluidas", excluidas)
+            informe.contar("procesos_bloques", jobs)
+        else:
+            for i, (r1, r2, recurso) in enumerate(tareas):
+                if i % 16 == 0:
+                    informe.avance("bloques", i, len(tareas))
+                rows, excluidas = _parse_block(ws, r1, r2, recurso, idx, excl)
+                all_rows.extend(rows)
+                informe.contar("filas_excluidas", excluidas)
+        informe.avance("bloques", len(tareas), len(tareas))
+    informe.contar("filas_rowdata", len(all_rows))
+
+    with informe.etapa("matriz_minutos"):
+        tabla = TablaHoras.from_rows(all_rows, n_days)
+    if informe.enabled:
+        hits, misses = token_cache_stats()
+        informe.contar("token_aciertos", hits - hits0)
+        informe.contar("token_fallos", misses - misses0)
+    return ParsedSheet(n_days, day_start, bloques, recursos, proyectos, tabla, excl)
+
+def parse_sheet(source, informe: Informe = SIN_INFORME, jobs: Optional[int] = None,
+                filename: Optional[str] = None, excl: Exclusiones = SIN_EXCLUSIONES) -> ParsedSheet:
+    """Abre y parsea una ruta, unos bytes o un fichero abierto.
+
+    Para reutilizar resultados, PARSE_CACHE.parse_path / parse_bytes (siempre
+    sin exclusiones, para que sirvan aunque estas cambien).
+    """
+    with informe.etapa("open"):
+        ws = open_grid(source, filename)
+    return parse_grid(ws, informe, jobs, excl)
 
-    all_rows = []; recursos = []; proyectos = {}
-    for (r1, r2) in bloques:
-        recurso = extract_recurso_line(ws, r1, n_days, day_start) or "RECURSO DESCONOCIDO"
-        if recurso not in recursos:
-            recursos.append(recurso)
-        rows = parse_block(ws, r1, r2, recurso, n_days, day_start)
-        for rd in rows:
-            if rd.proyecto_codigo and rd.proyecto_nombre:
-                proyectos[rd.proyecto_codigo] = rd.proyecto_nombre
-        all_rows.extend(rows)
-
-    collect_discovered(recursos, proyectos, persist)
-
-    all_rows = [
-        rd for rd in all_rows
-        if rd.recurso not in persist.excluir_recursos
-        and (rd.proyecto_codigo is None or rd.proyecto_codigo not in persist.excluir_proyectos)
-    ]
+# ======================================================================================
+# Libros de varias hojas
+# ======================================================================================
 
-    wb_out = Workbook(); wb_out.remove(wb_out.active)
-    build_output(wb_out, all_rows, persist, n_days)
-    base = os.path.splitext(os.path.basename(input_path))[0]
-    out = os.path.join(os.path.dirname(input_path), f"{base}_IPI.xlsx")
-    wb_out.save(out)
-    return out
+MODOS_MULTIHOJA = {
+    "hojas": "una hoja IPI por cada hoja de origen",
+    "unida": "una sola hoja IPI con la columna HOJA",
+}
+
+@dataclass
+class ParsedLibro:
+    """Las hojas de un libro con formato de parte, en su orden, ya parseadas."""
+    hojas: List[Tuple[str, ParsedSheet]]
+    descartadas: List[str] = field(default_factory=list)  # hojas sin rejilla de días o sin "Proyectos:"
+
+    @property
+    def recursos(self) -> List[str]:
+        return list(dict.fromkeys(r for _, p in self.hojas for r in p.recursos))
+
+    @property
+    def proyectos(self) -> Dict[str, str]:
+        out: Dict[str, str] = {}
+        for _, p in self.hojas:
+            out.update(p.proyectos)
+        return out
+
+    def discovered(self) -> Tuple[List[str], Dict[str, str]]:
+        return sorted(self.recursos), dict(sorted(self.proyectos.items()))
+
+def _parse_hoja(source, filename: Optional[str], hoja: str, excl: Exclusiones,
+                instrument: bool) -> Tuple[Optional[ParsedSheet], Informe]:
+    informe = Informe(enabled=instrument)
+    with informe.etapa("open"):
+        ws = open_grid(source, filename, hoja)
+    if not es_parte(ws):
+        return None, informe
+    return parse_grid(ws, informe, jobs=1, excl=excl), informe
+
+_shared_libro: Optional[Tuple] = None
+
+def _init_hoja_worker(source, filename: Optional[str], excl: Exclusiones, instrument: bool):
+    # El libro se envía una vez por proceso, no una por hoja.
+    global _shared_libro
+    _shared_libro = (source, filename, excl, instrument)
+
+def _parse_hoja_worker(hoja: str) -> Tuple[Optional[ParsedSheet], Informe]:
+    source, filename, excl, instrument = _shared_libro
+    return _parse_hoja(source, filename, hoja, excl, instrument)
+
+def parse_libro(source, filename: Optional[str] = None, informe: Informe = SIN_INFORME,
+                jobs: Optional[int] = None, excl: Exclusiones = SIN_EXCLUSIONES) -> ParsedLibro:
+    """Parsea todas las hojas con formato de parte, cada una en un proceso.
+
+    Las hojas sin rejilla de días o sin "Proyectos:" quedan en .descartadas; si
+    no hay ninguna válida se lanza RuntimeError como en parse_grid.
+    """
+    if not _is_path(source):
+        source = _as_bytes(source)
+    with informe.etapa("hojas"):
+        nombres = nombres_hojas(source, filename)
+    jobs = min(len(nombres), jobs or os.cpu_count() or 1)
+    n = len(nombres)
+    resultados = []
+    informe.avance("hojas", 0, n)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=MP_CONTEXT, initializer=_init_hoja_worker,
+                                 initargs=(source, filename, excl, informe.enabled)) as ex:
+            for res in ex.map(_parse_hoja_worker, nombres):
+                resultados.append(res)
+                informe.avance("hojas", len(resultados), n)
+        informe.contar("procesos_hojas", jobs)
+    else:
+        for hoja in nombres:
+            resultados.append(_parse_hoja(source, filename, hoja, excl, informe.enabled))
+            informe.avance("hojas", len(resultados), n)
+
+    libro = ParsedLibro([])
+    for hoja, (parsed, inf) in zip(nombres, resultados):
+        informe.merge(inf)
+        if parsed is None:
+            libro.descartadas.append(hoja)
+        else:
+            libro.hojas.append((hoja, parsed))
+    informe.contar("hojas_parte", len(libro.hojas))
+    informe.contar("hojas_descartadas", len(libro.descartadas))
+    if not libro.hojas:
+        raise RuntimeError("Ninguna hoja tiene rejilla de días y 'Proyectos:'")
+    return libro
+
+def filtrar_exclusiones(tabla: TablaHoras, persist: 'Persist') -> TablaHoras:
+    excl = Exclusiones.de(persist)
+    if not excl:
+        return tabla
+    return tabla.filtrar(np.fromiter((
+        not (excl.recurso(rd.recurso) or excl.proyecto(rd.proyecto_codigo))
+        for rd in tabla.rows
+    ), dtype=bool, count=len(tabla)))
 
 # ======================================================================================
-# UI (solo si hay Tkinter)
-# ======================================================================================
-
-if GUI_ENABLED:
-
-    def make_scrollframe(parent):
-        canvas = tk.Canvas(parent, borderwidth=0)
-        frame = ttk.Frame(canvas)
-        v = ttk.Scrollbar(parent, orient="vertical", command=canvas.yview)
-        canvas.configure(yscrollcommand=v.set)
-        v.pack(side="right", fill="y"); canvas.pack(side="left", fill="both", expand=True)
-        canvas.create_window((0, 0), window=frame, anchor="nw")
-        frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-        return frame
-
-    class App(tk.Tk):
-        def __init__(self):
-            super().__init__()
-            self.title("Transformador Excel → IPI")
-            self.geometry("980x560")
-            self.persist = Persist.load()
-            self.input_path = tk.StringVar(value="")
-            self._build()
-
-        def _build(self):
-            frm = ttk.Frame(self, padding=10); frm.pack(fill="both", expand=True)
-            row0 = ttk.Frame(frm); row0.pack(fill="x", pady=(0, 8))
-            ttk.Label(row0, text="Archivo Excel (.xlsx/.xls):").pack(side="left")
-            ttk.Entry(row0, textvariable=self.input_path, width=80).pack(side="left", padx=6, fill="x", expand=True)
-            ttk.Button(row0, text="Explorar…", command=self.on_browse).pack(side="left")
-            row1 = ttk.Frame(frm); row1.pack(fill="x", pady=(0, 8))
-            ttk.Button(row1, text="Clasificar proyectos…", command=self.on_edit_clasif).pack(side="left")
-            ttk.Button(row1, text="Definir exclusiones…", command=self.on_edit_excl).pack(side="left", padx=6)
-            ttk.Button(row1, text="Procesar y generar IPI", command=self.on_process).pack(side="left", padx=12)
-            ttk.Label(frm, text="1) Selecciona Excel. 2) Clasifica y excluye. 3) Genera IPI.").pack(anchor="w", pady=(12, 0))
-
-        def on_browse(self):
-            p = filedialog.askopenfilename(title="Selecciona Excel",
-                                           filetypes=[("Excel", "*.xlsx *.xls"), ("Todos", "*.*")])
-            if p:
-                self.input_path.set(p)
-
-        def on_edit_clasif(self):
-            proys = sorted(self.persist.tipos.keys())
-            if not proys:
-                messagebox.showinfo("Aviso", "No hay proyectos detectados. Carga un Excel primero."); return
-            dlg = tk.Toplevel(self); dlg.title("Clasificación de proyectos"); dlg.geometry("760x560")
-            container = ttk.Frame(dlg, padding=10); container.pack(fill="both", expand=True)
-            sf = make_scrollframe(container)
-            ttk.Label(sf, text="CÓDIGO", width=10).grid(row=0, column=0, sticky="w")
-            ttk.Label(sf, text="NOMBRE", width=50).grid(row=0, column=1, sticky="w")
-            ttk.Label(sf, text="CONSTRUCCIÓN", width=14).grid(row=0, column=2, sticky="w")
-            ttk.Label(sf, text="REPARACIÓN", width=12).grid(row=0, column=3, sticky="w")
-            vars_con = {}; vars_rep = {}
-            def toggle(c, who):
-                if who == "CON":
-                    if vars_con[c].get(): vars_rep[c].set(0)
-                else:
-                    if vars_rep[c].get(): vars_con[c].set(0)
-            for i, cod in enumerate(proys, start=1):
-                nombre = self.persist.nombres.get(cod, "")
-                ttk.Label(sf, text=cod, width=10).grid(row=i, column=0, sticky="w")
-                ttk.Label(sf, text=nombre, width=50).grid(row=i, column=1, sticky="w")
-                v1 = tk.IntVar(value=1 if self.persist.tipos.get(cod, "") == "CONSTRUCCION" else 0)
-                v2 = tk.IntVar(value=1 if self.persist.tipos.get(cod, "") == "REPARACION" else 0)
-                vars_con[cod] = v1; vars_rep[cod] = v2
-                ttk.Checkbutton(sf, variable=v1, command=lambda c=cod: toggle(c, "CON")).grid(row=i, column=2, padx=(6, 18))
-                ttk.Checkbutton(sf, variable=v2, command=lambda c=cod: toggle(c, "REP")).grid(row=i, column=3)
-            def save_close():
-                for cod in proys:
-                    if vars_con[cod].get() and not vars_rep[cod].get():
-                        self.persist.tipos[cod] = "CONSTRUCCION"
-                    elif vars_rep[cod].get() and not vars_con[cod].get():
-                        self.persist.tipos[cod] = "REPARACION"
-                    else:
-                        self.persist.tipos[cod] = ""
-                self.persist.asked_clasif = True; self.persist.save(); dlg.destroy()
-            ttk.Button(container, text="Guardar", command=save_close).pack(pady=8)
+# Modo streaming
+# ======================================================================================
 
-        def on_edit_excl(self):
-            if not self.input_path.get():
-                messagebox.showwarning("Atención", "Selecciona primero un archivo Excel."); return
-            try:
-                xlsx, wb = open_as_xlsx(self.input_path.get()); ws = wb.active
-                n_days, day_start = detect_day_grid(ws)
-                pos = find_all_proyectos_positions(ws)
-                recursos = set(); proyectos = {}
-                for i, r in enumerate(pos):
-                    recurso = extract_recurso_line(ws, r, n_days, day_start) or "RECURSO DESCONOCIDO"
-                    recursos.add(recurso)
-                    r1 = r; r2 = pos[i+1]-2 if i < len(pos)-1 else min(ws.max_row, r+120)
-                    for rr in range(r1, r2+1):
-                        t = read_cell(ws, rr, 1) or read_cell(ws, rr, 2)
-                        proj = normalize_project(t or "")
-                        if proj: proyectos[proj[0]] = proj[1]
-            except Exception as e:
-                messagebox.showerror("Error", str(e)); return
-            for k, v in proyectos.items():
-                if self.persist.nombres.get(k) != v: self.persist.nombres[k] = v
-            self.persist.save()
-            recursos = sorted(recursos); proyectos = dict(sorted(proyectos.items()))
-            dlg = tk.Toplevel(self); dlg.title("Exclusiones persistentes"); dlg.geometry("980x620")
-            container = ttk.Frame(dlg, padding=10); container.pack(fill="both", expand=True)
-            lf1 = ttk.Labelframe(container, text="Recursos a excluir"); lf1.pack(side="left", fill="both", expand=True, padx=(0, 6))
-            sf1 = make_scrollframe(lf1); rec_vars = {}
-            for i, r in enumerate(recursos):
-                var = tk.IntVar(value=1 if r in self.persist.excluir_recursos else 0); rec_vars[r] = var
-                ttk.Checkbutton(sf1, text=r, variable=var).grid(row=i, column=0, sticky="w", pady=2)
-            lf2 = ttk.Labelframe(container, text="Proyectos a excluir"); lf2.pack(side="left", fill="both", expand=True, padx=(6, 0))
-            sf2 = make_scrollframe(lf2); proy_vars = {}
-            for i, (cod, nom) in enumerate(proyectos.items()):
-                var = tk.IntVar(value=1 if cod in self.persist.excluir_proyectos else 0); proy_vars[cod] = var
-                ttk.Checkbutton(sf2, text=f"{cod} - {nom}", variable=var).grid(row=i, column=0, sticky="w", pady=2)
-            def save_close():
-                self.persist.excluir_recursos  = [k for k, v in rec_vars.items() if v.get() == 1]
-                self.persist.excluir_proyectos = [k for k, v in proy_vars.items() if v.get() == 1]
-                self.persist.asked_excl = True; self.persist.save(); dlg.destroy()
-            ttk.Button(container, text="Guardar exclusiones", command=save_close).pack(side="bottom", pady=8)
-
-        def _ensure_prompts(self):
-            need_class = any(v == "" for v in self.persist.tipos.values())
-            if need_class or not self.persist.asked_clasif:
-                if messagebox.askyesno("Clasificar proyectos", "Hay proyectos sin tipo o es la primera vez. ¿Clasificar ahora?"):
-                    self.on_edit_clasif()
-                else:
-                    self.persist.asked_clasif = True; self.persist.save()
-            if not self.persist.asked_excl:
-                if messagebox.askyesno("Definir exclusiones", "¿Quieres definir exclusiones ahora?"):
-                    self.on_edit_excl()
+class SheetStream:
+    """Recorrido de la hoja en orden, fila a fila, sin cargarla ni guardar las filas.
+
+    Solo se retienen las primeras CABECERA filas (para detect_day_grid). Los
+    bloques "Proyectos:" se detectan sobre la marcha con una fila de retraso: la
+    fila anterior a cada etiqueta es la línea de recurso y no pertenece al bloque
+    previo (r2 = etiqueta - 2, como en parse_grid). Iterar produce las RowData
+    que daría parse_grid, con las exclusiones ya aplicadas; recursos y proyectos
+    se van descubriendo igual. Con parsear=False solo se descubren.
+
+    La memoria es constante solo con .xlsx: xlrd no lee por filas y XlsReader
+    carga la hoja .xls entera (sin normalizar ni indexar, pero crece con ella).
+    """
+    CABECERA = 80
+
+    def __init__(self, source, filename: Optional[str] = None, excl: Exclusiones = SIN_EXCLUSIONES,
+                 informe: Informe = SIN_INFORME, parsear: bool = True):
+        self.excl = excl
+        self.informe = informe
+        self.parsear = parsear
+        with informe.etapa("open"):
+            self.reader = open_reader(source, filename)
+        self.total_filas = self.reader.filas_estimadas()
+        self._filas = (_normalize_values(v, {}) for v in self.reader.iter_values())
+        self._cabecera = list(itertools.islice(self._filas, self.CABECERA))
+        with informe.etapa("detect_day_grid"):
+            self.n_days, self.day_start = detect_day_grid(SheetGrid(self._cabecera))
+        self.recursos: List[str] = []
+        self.proyectos: Dict[str, str] = {}
+        self.bloques = 0
+        self.filas_leidas = 0
+        self._vistos = set()
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _feed(self, bp: _BlockParser, pend) -> Optional[RowData]:
+        row, f, proj, tipos = pend
+        if not bp.filas:  # primera fila: el bloque no está vacío
+            self.bloques += 1
+            if bp.recurso not in self._vistos:
+                self._vistos.add(bp.recurso)
+                self.recursos.append(bp.recurso)
+            if self.parsear and not bp.activo:
+                self.informe.contar("bloques_excluidos")
+        bp.filas += 1
+        if proj and proj[1]:
+            self.proyectos[proj[0]] = proj[1]
+        antes = bp.excluidas
+        rd = bp.feed(row, f & F_GARBAGE, proj, tipos)
+        if self.parsear and bp.excluidas != antes:
+            self.informe.contar("filas_excluidas")
+        return rd
+
+    def __iter__(self) -> Iterator[RowData]:
+        n_days, day_start, excl, informe = self.n_days, self.day_start, self.excl, self.informe
+        bp: Optional[_BlockParser] = None   # bloque abierto
+        pend = None                         # fila anterior, aún sin asignar
+        recurso_previo = None
+        for r, row in enumerate(itertools.chain(self._cabecera, self._filas), start=1):
+            if r % 2000 == 0:
+                informe.avance("filas leídas", r, self.total_filas)
+            f, proj, tipos = _rasgos_fila(row, day_start, n_days)
+            if f & F_TAG:
+                recurso = recurso_previo or "RECURSO DESCONOCIDO"
+                bp = _BlockParser(recurso, n_days, day_start, excl,
+                                  activo=self.parsear and not excl.recurso(recurso))
+            elif pend is not None and bp is not None:
+                rd = self._feed(bp, pend)
+                if rd is not None:
+                    yield rd
+            pend = (row, f, proj, tipos)
+            if not f & F_GARBAGE:
+                recurso_previo = _linea_recurso(row) or recurso_previo
+            self.filas_leidas = r
+        if pend is not None and bp is not None:
+            rd = self._feed(bp, pend)
+            if rd is not None:
+                yield rd
+        self._cabecera = []
+        if bp is None:
+            # Como parse_grid; se lanza antes de guardar nada, así que no queda salida vacía.
+            raise RuntimeError("No se encontró 'Proyectos:'")
+
+def discover_stream(source, filename: Optional[str] = None) -> Tuple[List[str], Dict[str, str]]:
+    """(recursos, proyectos) ordenados, como ParsedSheet.discovered(), sin parsear los bloques."""
+    with SheetStream(source, filename, parsear=False) as stream:
+        for _ in stream:
+            pass
+    return sorted(stream.recursos), dict(sorted(stream.proyectos.items()))
+
+def _con_minutos(stream: SheetStream, informe: Informe):
+    """(RowData, minutos por día) de cada fila del stream, contando filas."""
+    n_days = stream.n_days
+    for rd in stream:
+        informe.contar("filas_rowdata")
+        yield rd, [hhmm_to_minutes(v) for v in rd.horas_por_dia[:n_days]]
+
+def _registros_stream(filas, persist: 'Persist'):
+    """Como iter_registros, pero sobre (RowData, minutos) según llegan."""
+    for rd, mins in filas:
+        base = (rd.recurso, rd.proyecto_codigo, rd.proyecto_nombre, rd.tipo_imputacion or None,
+                persist.tipos.get(rd.proyecto_codigo, "") or None)
+        for d, m in enumerate(mins, start=1):
+            if m:
+                yield base + (d, m)
+
+def _ipi_stream(stream: SheetStream, persist: 'Persist', informe: Informe, dest) -> int:
+    """Escribe el IPI y los resúmenes fila a fila; en memoria solo queda el cubo."""
+    n_days = stream.n_days
+    wb_out = libro_salida()
+    ws, n_cols = _ipi_hoja(wb_out, n_days)
+    acum = AcumuladorCubo(n_days)
+    n = 0
+    try:
+        for rd, mins in _con_minutos(stream, informe):
+            acum.add(rd, mins)
+            _ipi_fila(ws, fila_fija(rd, sum(mins), n_days), persist.tipos.get(rd.proyecto_codigo, ""), n_cols)
+            n += 1
+    except BaseException:
+        ws.close()  # cierra el temporal de la hoja write-only antes de propagar
+        raise
+    cubo = acum.cubo()
+    celdas = n_cols * (n + 1) + _ipi_totales(ws, cubo, persist, n_cols) + build_resumenes(wb_out, cubo, persist)
+    wb_out.save(dest)
+    return celdas
+
+def process_file(source, persist: 'Persist', parsed: Optional[ParsedSheet]=None,
+                 out_dir: Optional[str]=None, instrument: bool = True,
+                 filename: Optional[str] = None, progreso: Optional[Progreso] = None,
+                 formato: str = "xlsx", streaming: bool = False,
+                 multihoja: Optional[str] = None) -> Informe:
+    """Genera el IPI (o, con formato, los registros) de una ruta, unos bytes o un fichero abierto.
+
+    Dónde se escribe: _destino. Modos streaming y multihoja: _process_stream y
+    _process_libro. Sin parsed se usa PARSE_CACHE; progreso permite seguir y cancelar.
+    """
+    informe = Informe(enabled=instrument, progreso=progreso)
+    if _is_path(source):
+        name = os.path.basename(os.fspath(source))
+    else:
+        source = _as_bytes(source)
+        # Sin filename, la extensión (y con ella el lector) sale de la firma del contenido.
+        name = filename or "entrada" + (source_ext(source) or ".xlsx")
+    if multihoja:
+        return _process_libro(source, name, persist, informe, out_dir, parsed, multihoja, formato, streaming)
+    if streaming and parsed is None:
+        return _process_stream(source, name, persist, informe, out_dir, formato)
+    if parsed is None:
+        if _is_path(source):
+            parsed = PARSE_CACHE.parse_path(source, informe)
+        else:
+            parsed = PARSE_CACHE.parse_bytes(source, name, informe)
+    with informe.etapa("collect_discovered"):
+        collect_discovered(parsed.recursos, parsed.proyectos, persist)
+
+    with informe.etapa("exclusiones"):
+        tabla = filtrar_exclusiones(parsed.tabla, persist)
+    informe.contar("filas_excluidas", len(parsed.tabla) - len(tabla))
+
+    dest, exp_cls = _destino(source, name, informe, out_dir, formato)
+    if exp_cls is not None:
+        with informe.etapa("exportar"):
+            with exp_cls(dest) as exp:
+                informe.contar("registros_exportados", exp.write(iter_registros(tabla, persist)))
+        if informe.buffer is not None:
+            informe.buffer.seek(0)
+        return informe
+
+    with informe.etapa("agregacion"):
+        cubo = CuboHoras.from_tabla(tabla)
+    with informe.etapa("build_output"):
+        wb_out = libro_salida()
+        informe.contar("celdas_escritas", build_output(wb_out, tabla, persist, parsed.n_days,
+                                                       informe=informe, cubo=cubo))
+        informe.contar("celdas_escritas", build_resumenes(wb_out, cubo, persist))
+    with informe.etapa("save"):
+        wb_out.save(dest)
+    if informe.buffer is not None:
+        informe.buffer.seek(0)
+    return informe
+
+def _destino(source, name: str, informe: Informe, out_dir: Optional[str], formato: str):
+    """Fija nombre_salida y salida/buffer en informe; devuelve (destino, exportador o None).
+
+    Con una ruta o out_dir se escribe a disco (.salida); si no, en .buffer (BytesIO).
+    formato csv/jsonl/parquet escribe registros en formato largo (ver iter_registros).
+    """
+    exp_cls = None
+    ext = ".xlsx"
+    if formato != "xlsx":
+        exp_cls = EXPORTADORES.get(formato)
+        if exp_cls is None:
+            raise ValueError(f"Formato de salida no soportado: {formato}")
+        ext = exp_cls.extension
+    informe.nombre_salida = os.path.splitext(name)[0] + "_IPI" + ext
+    if _is_path(source) or out_dir:
+        out_dir = out_dir or os.path.dirname(os.fspath(source))
+        informe.salida = os.path.join(out_dir, informe.nombre_salida)
+        return informe.salida, exp_cls
+    informe.buffer = io.BytesIO()
+    return informe.buffer, exp_cls
+
+def _firma_fichero(path: Optional[str]):
+    try:
+        st_ = os.stat(path) if path else None
+    except OSError:
+        return None
+    return st_ and (st_.st_mtime_ns, st_.st_size)
+
+def _process_stream(source, name: str, persist: 'Persist', informe: Informe,
+                    out_dir: Optional[str], formato: str) -> Informe:
+    """Lee la hoja y escribe la salida fila a fila (ver SheetStream): con .xlsx la
+    memoria no crece con la entrada; con .xls xlrd sigue cargando la hoja entera."""
+    dest, exp_cls = _destino(source, name, informe, out_dir, formato)
+    previa = _firma_fichero(informe.salida)
+    try:
+        with SheetStream(source, name, Exclusiones.de(persist), informe) as stream:
+            with informe.etapa("stream"):
+                if exp_cls is not None:
+                    with exp_cls(dest) as exp:
+                        informe.contar("registros_exportados",
+                                       exp.write(_registros_stream(_con_minutos(stream, informe), persist)))
                 else:
-                    self.persist.asked_excl = True; self.persist.save()
+                    informe.contar("celdas_escritas", _ipi_stream(stream, persist, informe, dest))
+    except BaseException:
+        # No dejar una salida a medias, pero sin borrar una anterior que no se llegó a tocar.
+        if informe.salida and os.path.exists(informe.salida) and _firma_fichero(informe.salida) != previa:
+            os.remove(informe.salida)
+        raise
+    informe.contar("filas_escaneadas", stream.filas_leidas)
+    informe.contar("bloques", stream.bloques)
+    informe.descubiertos = (stream.recursos, stream.proyectos)
+    with informe.etapa("collect_discovered"):
+        collect_discovered(stream.recursos, stream.proyectos, persist)
+    if informe.buffer is not None:
+        informe.buffer.seek(0)
+    return informe
+
+def _process_libro(source, name: str, persist: 'Persist', informe: Informe, out_dir: Optional[str],
+                   libro: Optional[ParsedLibro], modo: str, formato: str, streaming: bool) -> Informe:
+    """Todas las hojas con formato de parte (ver MODOS_MULTIHOJA); libro, si se pasa,
+    viene de parse_libro. Solo genera el IPI .xlsx."""
+    if modo not in MODOS_MULTIHOJA:
+        raise ValueError(f"Modo multihoja no soportado: {modo}")
+    if formato != "xlsx" or streaming:
+        raise ValueError("El modo multihoja solo genera el IPI .xlsx, sin streaming")
+    if libro is None:
+        libro = parse_libro(source, name, informe, excl=Exclusiones.de(persist))
+    with informe.etapa("collect_discovered"):
+        collect_discovered(libro.recursos, libro.proyectos, persist)
+    with informe.etapa("exclusiones"):
+        tablas = [filtrar_exclusiones(parsed.tabla, persist) for _, parsed in libro.hojas]
+    informe.contar("filas_excluidas", sum(len(p.tabla) for _, p in libro.hojas) - sum(len(t) for t in tablas))
+    dest, _ = _destino(source, name, informe, out_dir, formato)
+
+    with informe.etapa("agregacion"):
+        unida = TablaHoras.unir(tablas)
+        cubo = CuboHoras.from_tabla(unida)
+    with informe.etapa("build_output"):
+        wb_out = libro_salida()
+        if modo == "unida":
+            origen = [hoja for (hoja, _), t in zip(libro.hojas, tablas) for _ in range(len(t))]
+            informe.contar("celdas_escritas", build_output(wb_out, unida, persist, unida.n_days,
+                                                           informe=informe, cubo=cubo, origen=origen))
+        else:
+            used = {t.upper() for t in (SHEET_POR_RECURSO, SHEET_POR_PROYECTO, SHEET_POR_DIA, SHEET_TIPO_RECURSO)}
+            for (hoja, parsed), tabla in zip(libro.hojas, tablas):
+                informe.contar("celdas_escritas", build_output(wb_out, tabla, persist, parsed.n_days,
+                                                               sheet_name=_sheet_title(hoja, used), informe=informe))
+        # Los resúmenes suman todas las hojas.
+        informe.contar("celdas_escritas", build_resumenes(wb_out, cubo, persist))
+    with informe.etapa("save"):
+        wb_out.save(dest)
+    if informe.buffer is not None:
+        informe.buffer.seek(0)
+    return informe
 
-        def on_process(self):
-            if not self.input_path.get():
-                messagebox.showwarning("Atención", "Selecciona un archivo primero."); return
-            self._ensure_prompts()
+# ======================================================================================
+# Caché de parseo
+# ======================================================================================
+
+PARSER_VERSION = "2"  # subir cuando cambie el resultado del parseo para invalidar cachés
+
+class ParseCache:
+    """Caché de ParsedSheet por SHA-256 del contenido y versión del parser.
+
+    Nivel en memoria LRU acotado a max_items; si se indica disk_dir, los
+    resultados se guardan también en disco (pickle) y sobreviven a reinicios.
+    """
+
+    def __init__(self, max_items: int = 8, disk_dir: Optional[str] = None):
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        self._mem: "OrderedDict[str, ParsedSheet]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data: bytes) -> str:
+        h = hashlib.sha256(data)
+        h.update(PARSER_VERSION.encode())
+        return h.hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def get(self, key: str) -> Optional[ParsedSheet]:
+        with self._lock:
+            parsed = self._mem.get(key)
+            if parsed is not None:
+                self._mem.move_to_end(key)
+                return parsed
+        if self.disk_dir:
             try:
-                out = process_file(self.input_path.get(), self.persist)
-            except Exception as e:
-                messagebox.showerror("Error", str(e)); return
-            messagebox.showinfo("Listo", f"Generado:\n{out}")
+                with open(self._disk_path(key), "rb") as f:
+                    parsed = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+                return None
+            if not isinstance(parsed, (ParsedSheet, ParsedLibro)):
+                # Pickle de otra versión o guardado bajo otro nombre de módulo (__main__): fallo.
+                return None
+            self._remember(key, parsed)
+            return parsed
+        return None
+
+    def put(self, key: str, parsed: ParsedSheet):
+        self._remember(key, parsed)
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            tmp = self._disk_path(key) + f".{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._disk_path(key))
+
+    def _remember(self, key: str, parsed: ParsedSheet):
+        with self._lock:
+            self._mem[key] = parsed
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_items:
+                self._mem.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+
+    def prune(self, keep: set):
+        """Borra del disco las entradas cuya clave no está en keep."""
+        if not self.disk_dir:
+            return
+        try:
+            nombres = os.listdir(self.disk_dir)
+        except OSError:
+            return
+        for n in nombres:
+            if n.endswith(".pkl") and n[:-4] not in keep:
+                try:
+                    os.remove(os.path.join(self.disk_dir, n))
+                except OSError:
+                    pass
+
+    def parse_path(self, path: str, informe: Informe = SIN_INFORME) -> ParsedSheet:
+        with informe.etapa("hash"):
+            with open(path, "rb") as f:
+                key = self.key(f.read())
+        parsed = self.get(key)
+        if parsed is None:
+            parsed = parse_sheet(path, informe)
+            self.put(key, parsed)
+        else:
+            informe.contar("cache_aciertos")
+        return parsed
+
+    def parse_bytes(self, data: bytes, filename: Optional[str] = None,
+                    informe: Informe = SIN_INFORME) -> ParsedSheet:
+        """Como parse_path, pero para contenido en memoria; filename aporta la extensión."""
+        with informe.etapa("hash"):
+            key = self.key(data)
+        parsed = self.get(key)
+        if parsed is None:
+            parsed = parse_sheet(data, informe, filename=filename)
+            self.put(key, parsed)
+        else:
+            informe.contar("cache_aciertos")
+        return parsed
+
+PARSE_CACHE = ParseCache(
+    max_items=int(os.environ.get("PARSE_CACHE_ITEMS", "8")),
+    disk_dir=os.environ.get("PARSE_CACHE_DIR") or None,
+)
 
-else:
-    App = None
+# ======================================================================================
+# Trabajos en segundo plano
+# ======================================================================================
+
+class Trabajo:
+    __slots__ = ("id", "future", "progreso", "creado")
+
+    def __init__(self, id_: str, future, progreso: Progreso):
+        self.id = id_
+        self.future = future
+        self.progreso = progreso
+        self.creado = time.time()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+class JobManager:
+    """Ejecutor acotado de trabajos (p. ej. process_file) para interfaces interactivas.
+
+    max_workers hilos procesan a la vez y como mucho max_pending esperan en
+    cola; cada trabajo recibe un Progreso (kwarg progreso) que la interfaz
+    consulta y puede cancelar. Los trabajos terminados se olvidan al recogerlos
+    o pasados ttl segundos.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 8, ttl: float = 3600.0):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ipi")
+        self._jobs: Dict[str, Trabajo] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> str:
+        with self._lock:
+            self._prune()
+            if sum(1 for j in self._jobs.values() if not j.done()) >= self.max_pending:
+                raise RuntimeError("Hay demasiados trabajos en curso; inténtalo en unos segundos.")
+            progreso = Progreso()
+            job_id = uuid.uuid4().hex
+            fut = self._pool.submit(fn, *args, progreso=progreso, **kwargs)
+            self._jobs[job_id] = Trabajo(job_id, fut, progreso)
+            return job_id
+
+    def get(self, job_id: str) -> Optional[Trabajo]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        job = self.get(job_id)
+        if job is not None:
+            job.progreso.cancel()
+            job.future.cancel()  # si aún no había empezado
+
+    def forget(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _prune(self):
+        limite = time.time() - self.ttl
+        for k in [k for k, j in self._jobs.items() if j.done() and j.creado < limite]:
+            del self._jobs[k]
+
+# ======================================================================================
+# Lote (CLI sin interfaz)
+# ======================================================================================
+
+def expand_inputs(patterns: List[str], excluir: Tuple[str, ...] = ()) -> List[str]:
+    """Expande ficheros y globs a una lista ordenada sin duplicados.
+
+    Se saltan las salidas propias: los *_IPI.xlsx, los consolidados (los que tienen
+    <fichero>.manifest.json al lado) y las rutas de excluir, comparadas por ruta real.
+    """
+    excluir_real = {os.path.realpath(p) for p in excluir}
+    out = []
+    for pat in patterns:
+        matches = sorted(glob.glob(pat, recursive=True)) if glob.has_magic(pat) else [pat]
+        for p in matches:
+            if (os.path.splitext(p)[1].lower() in (".xls", ".xlsx") and not p.endswith("_IPI.xlsx")
+                    and os.path.realpath(p) not in excluir_real
+                    and not os.path.exists(p + ".manifest.json") and p not in out):
+                out.append(p)
+    return out
+
+def _batch_one(path: str, persist: 'Persist', out_dir: Optional[str], block_jobs: int = 1,
+               formato: str = "xlsx", streaming: bool = False, multihoja: Optional[str] = None,
+               jobs_hojas: int = 1) -> Dict:
+    t0 = time.perf_counter()
+    res = {"archivo": path, "salida": None, "filas": 0, "recursos": 0, "proyectos": 0,
+           "segundos": 0.0, "error": None, "informe": None, "descubiertos": {}}
+    try:
+        if streaming:
+            informe = process_file(path, persist, out_dir=out_dir, formato=formato, streaming=True)
+            recursos, proyectos = informe.descubiertos
+            res["salida"] = informe.salida
+            res["informe"] = informe.to_dict()
+            res["filas"] = informe.contadores.get("filas_rowdata", 0)
+            res["recursos"] = len(recursos)
+            res["proyectos"] = len(proyectos)
+            res["descubiertos"] = proyectos
+            res["segundos"] = round(time.perf_counter() - t0, 3)
+            return res
+        informe = Informe()
+        if multihoja:
+            parsed = parse_libro(path, informe=informe, jobs=jobs_hojas, excl=Exclusiones.de(persist))
+        else:
+            parsed = parse_sheet(path, informe, jobs=block_jobs, excl=Exclusiones.de(persist))
+        hecho = process_file(path, persist, parsed=parsed, out_dir=out_dir, formato=formato, multihoja=multihoja)
+        informe.merge(hecho).salida = res["salida"] = hecho.salida
+        res["informe"] = informe.to_dict()
+        # filas_rowdata ya descuenta lo excluido al parsear; solo queda lo filtrado al procesar.
+        res["filas"] = informe.contadores["filas_rowdata"] - hecho.contadores["filas_excluidas"]
+        res["recursos"] = len(parsed.recursos)
+        res["proyectos"] = len(parsed.proyectos)
+        res["descubiertos"] = parsed.proyectos
+    except Exception as e:
+        res["error"] = f"{type(e).__name__}: {e}"
+    res["segundos"] = round(time.perf_counter() - t0, 3)
+    return res
+
+def run_batch(paths: List[str], persist: 'Persist', jobs: int = 1,
+              out_dir: Optional[str] = None, block_jobs: int = 1, formato: str = "xlsx",
+              streaming: bool = False, multihoja: Optional[str] = None) -> List[Dict]:
+    """Procesa varios ficheros en un pool de procesos.
+
+    Los trabajadores reciben una instantánea de solo lectura de persist; los
+    proyectos descubiertos se fusionan y guardan una sola vez, aquí, al final.
+    """
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    snap = persist.snapshot()
+    if jobs <= 1 or len(paths) <= 1:
+        # Un solo fichero a la vez: los procesos se aprovechan dentro del fichero, por bloques
+        # o, en modo multihoja, por hojas.
+        results = [_batch_one(p, snap, out_dir, block_jobs, formato, streaming, multihoja, jobs) for p in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            n = len(paths)
+            results = list(ex.map(_batch_one, paths, [snap] * n, [out_dir] * n, [1] * n, [formato] * n,
+                                  [streaming] * n, [multihoja] * n))
+    descubiertos: Dict[str, str] = {}
+    for res in results:
+        descubiertos.update(res.pop("descubiertos"))
+    collect_discovered([], descubiertos, persist)
+    return results
+
+def print_batch_summary(results: List[Dict], file=None):
+    file = file or sys.stdout
+    print(f"{'ARCHIVO':<40} {'FILAS':>7} {'RECURSOS':>9} {'PROYECTOS':>10} {'SEG':>8}", file=file)
+    for r in results:
+        name = os.path.basename(r["archivo"])[:40]
+        if r["error"]:
+            print(f"{name:<40} ERROR: {r['error']}", file=file)
+        else:
+            print(f"{name:<40} {r['filas']:>7} {r['recursos']:>9} {r['proyectos']:>10} {r['segundos']:>8.2f}", file=file)
+
+# ======================================================================================
+# Consolidado anual
+# ======================================================================================
+
+SHEET_ACUMULADO = "ACUMULADO"
+
+def _sheet_title(base: str, used: set) -> str:
+    t = re.sub(r"[\\/*?:\[\]]", "_", base)[:31] or "HOJA"
+    k = 2
+    while t.upper() in used:
+        suf = f"~{k}"; t = t[:31-len(suf)] + suf; k += 1
+    used.add(t.upper())
+    return t
+
+def _load_manifest(path: str) -> Dict[str, Dict]:
+    """Ficheros del manifiesto; vacío si no existe o es de otra versión del parser."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("parser") != PARSER_VERSION:
+        return {}
+    return data.get("ficheros", {})
+
+def _save_manifest(path: str, ficheros: Dict[str, Dict]):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"parser": PARSER_VERSION, "ficheros": ficheros}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def _write_ytd_block(ws, titulo: str, meses: List[str], por_mes: List[Dict[str, int]], n_cols: int):
+    """Bloque clave × mes (horas decimales) + TOTAL y TOTAL DEC acumulados."""
+    ws.append(_styled_row(ws, [titulo] + meses + ["TOTAL", "TOTAL DEC"], STYLE_HEADER, n_cols))
+    claves = sorted(set().union(*por_mes)) if por_mes else []
+    for k in claves:
+        vals = [d.get(k, 0) for d in por_mes]
+        total = sum(vals)
+        ws.append([k] + [round(v/60.0, 2) for v in vals] + [minutes_to_hhmm(total), round(total/60.0, 2)])
+    ws.append([])
+
+def consolidate(paths: List[str], persist: 'Persist', out_path: str) -> Dict[str, int]:
+    """Une varias exportaciones mensuales en un libro con una hoja IPI por mes y
+    una hoja ACUMULADO con los totales del año.
+
+    Junto a out_path se guarda un manifiesto (<salida>.manifest.json) con el hash
+    de cada fichero y una caché en disco de sus ParsedSheet: al regenerar solo se
+    vuelven a parsear los meses nuevos o modificados.
+    """
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    manifest_path = out_path + ".manifest.json"
+    cache = ParseCache(max_items=len(paths) or 1, disk_dir=os.path.join(out_dir, ".ipi_cache"))
+    old = _load_manifest(manifest_path)
+    ficheros: Dict[str, Dict] = {}
+    stats = {"ficheros": len(paths), "parseados": 0, "reutilizados": 0}
+
+    meses: List[Tuple[str, ParsedSheet]] = []
+    for p in paths:
+        st_ = os.stat(p)
+        name = os.path.abspath(p)
+        prev = old.get(name)
+        parsed = None
+        if prev and prev.get("size") == st_.st_size and prev.get("mtime") == st_.st_mtime:
+            key = prev["sha256"]
+            parsed = cache.get(key)
+        if parsed is None:
+            with open(p, "rb") as f:
+                key = cache.key(f.read())
+            parsed = cache.get(key)
+        if parsed is None:
+            parsed = parse_sheet(p)
+            cache.put(key, parsed)
+            stats["parseados"] += 1
+        else:
+            stats["reutilizados"] += 1
+        ficheros[name] = {"sha256": key, "size": st_.st_size, "mtime": st_.st_mtime}
+        meses.append((os.path.splitext(os.path.basename(p))[0], parsed))
+
+    descubiertos: Dict[str, str] = {}
+    for _, parsed in meses:
+        descubiertos.update(parsed.proyectos)
+    collect_discovered([], descubiertos, persist)
+
+    tablas = [filtrar_exclusiones(parsed.tabla, persist) for _, parsed in meses]
+    cubos = [CuboHoras.from_tabla(t) for t in tablas]
+    por_recurso = [c.por_recurso() for c in cubos]
+    por_proyecto = [{f"{cod} - {nom}": v for (cod, nom), v in c.por_proyecto().items()} for c in cubos]
+    por_imput = [c.por_tipo_imputacion() for c in cubos]
+    por_tipo = [c.por_tipo_proyecto(persist) for c in cubos]
+
+    wb_out = libro_salida()
+    register_styles(wb_out)
+    used = {SHEET_ACUMULADO}
+    titulos = [_sheet_title(base, used) for base, _ in meses]
+    ws = wb_out.create_sheet(SHEET_ACUMULADO)
+    ws.column_dimensions["A"].width = 48
+    n_cols = len(meses) + 3
+    _write_ytd_block(ws, "RECURSO", titulos, por_recurso, n_cols)
+    _write_ytd_block(ws, "PROYECTO", titulos, por_proyecto, n_cols)
+    _write_ytd_block(ws, "TIPO IMPUTACIÓN", titulos, por_imput, n_cols)
+    _write_ytd_block(ws, "TIPO PROYECTO", titulos,
+                     [{k: v for k, v in d.items() if k in STYLE_POR_TIPO} for d in por_tipo], n_cols)
+    for titulo, (_, parsed), tabla, cubo in zip(titulos, meses, tablas, cubos):
+        build_output(wb_out, tabla, persist, parsed.n_days, sheet_name=titulo, cubo=cubo)
+    wb_out.save(out_path)
+    _save_manifest(manifest_path, ficheros)
+    cache.prune({f["sha256"] for f in ficheros.values()})
+    return stats
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="horas", description="Transformador Excel → IPI")
+    sub = ap.add_subparsers(dest="cmd")
+    b = sub.add_parser("batch", help="procesa varios ficheros sin interfaz gráfica")
+    b.add_argument("inputs", nargs="+", help="ficheros .xls/.xlsx o globs")
+    b.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1, help="procesos en paralelo")
+    b.add_argument("--out", "-o", default=None, help="carpeta de salida (por defecto, junto a cada entrada)")
+    b.add_argument("--block-jobs", type=int, default=BLOCK_JOBS,
+                   help="procesos para parsear los bloques de cada fichero (solo con --jobs 1)")
+    b.add_argument("--informe", default=None, metavar="FICHERO",
+                   help="escribe el informe de etapas y contadores de cada fichero en JSON ('-' = stdout)")
+    b.add_argument("--formato", choices=["xlsx"] + list(EXPORTADORES), default="xlsx",
+                   help="xlsx = hoja IPI; csv/jsonl/parquet = registros por recurso, proyecto y día")
+    b.add_argument("--streaming", action="store_true",
+                   help="lee y escribe fila a fila, con memoria constante en .xlsx (en .xls xlrd carga la hoja)")
+    b.add_argument("--multihoja", choices=list(MODOS_MULTIHOJA), default=None,
+                   help="procesa todas las hojas con formato de parte: " +
+                        "; ".join(f"{k} = {v}" for k, v in MODOS_MULTIHOJA.items()))
+    c = sub.add_parser("consolidar", help="une exportaciones mensuales en un IPI acumulado")
+    c.add_argument("carpeta", help="carpeta con las exportaciones mensuales .xls/.xlsx")
+    c.add_argument("--out", "-o", default=None, help="libro de salida (por defecto <carpeta>/IPI_ACUMULADO.xlsx)")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "consolidar":
+        out = args.out or os.path.join(args.carpeta, "IPI_ACUMULADO.xlsx")
+        paths = sorted(expand_inputs([os.path.join(args.carpeta, "*.xls"), os.path.join(args.carpeta, "*.xlsx")],
+                                     excluir=(out,)))
+        if not paths:
+            ap.error("no hay ficheros .xls/.xlsx que consolidar")
+        stats = consolidate(paths, _cargar_persist(), out)
+        print(f"{out}: {stats['ficheros']} ficheros, {stats['parseados']} parseados, {stats['reutilizados']} reutilizados")
+        return 0
+
+    if args.cmd == "batch":
+        paths = expand_inputs(args.inputs)
+        if not paths:
+            ap.error("no hay ficheros .xls/.xlsx que procesar")
+        if args.multihoja and (args.streaming or args.formato != "xlsx"):
+            ap.error("--multihoja solo admite --formato xlsx y no se combina con --streaming")
+        results = run_batch(paths, _cargar_persist(), jobs=args.jobs, out_dir=args.out,
+                            block_jobs=args.block_jobs, formato=args.formato, streaming=args.streaming,
+                            multihoja=args.multihoja)
+        print_batch_summary(results, file=sys.stderr if args.informe == "-" else None)
+        if args.informe:
+            data = json.dumps([dict(r["informe"] or {}, archivo=r["archivo"]) for r in results],
+                              ensure_ascii=False, indent=2)
+            if args.informe == "-":
+                print(data)
+            else:
+                with open(args.informe, "w", encoding="utf-8") as f:
+                    f.write(data)
+        if args.out:
+            with open(os.path.join(args.out, "resumen_lote.json"), "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+        return 1 if any(r["error"] for r in results) else 0
+
+    App = _gui_app()
+    if App is None:
+        raise SystemExit("Tkinter no disponible. Usa la versión web o 'python -m horas batch'.")
+    App().mainloop()  # App carga Persist, que crea la base de datos (importando el JSON) si no existe
+    return 0
+
+def _cargar_persist() -> Persist:
+    persist = Persist.load()
+    if persist.conflictos_importados:
+        print(describir_conflictos(persist.conflictos_importados), file=sys.stderr)
+    return persist
+
+def _gui_app():
+    """Clase App de gui.py, o None si Tkinter no está disponible."""
+    if not GUI_ENABLED:
+        return None
+    try:
+        from gui import App
+    except ImportError:
+        return None
+    return App
+
+def __getattr__(name):
+    # Compatibilidad: horas.App sigue existiendo, pero Tkinter se carga al pedirla.
+    if name == "App":
+        return _gui_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ======================================================================================
 # Lanzador
 # ======================================================================================
 
 if __name__ == "__main__":
-    if not GUI_ENABLED:
-        raise SystemExit("Tkinter no disponible. Usa la versión web.")
-    if not os.path.exists(JSON_PATH):
-        Persist().save()
-    App().mainloop()
+    # Se delega en el módulo importado para que los pickles de la caché sean siempre horas.*.
+    from horas import main as _main
+    sys.exit(_main())